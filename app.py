@@ -3,20 +3,29 @@ import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
 import seaborn as sns
-from io import StringIO
+from io import BytesIO, StringIO
 
 # Importar módulos locais
 from data_fetcher import get_company_profile, get_financial_statements
+from position_builder import update_positions_from_files
 from valuation import (
     calculate_dcf, calculate_multiples_valuation, calculate_graham_valuation,
     calculate_bazin_valuation, calculate_ddm_valuation, calculate_patrimonial_value,
     calculate_opportunity_score, get_buy_signal
 )
 from portfolio_optimizer import (
-    identify_asset_class, calculate_current_allocation, markowitz_optimization,
-    hrp_optimization, risk_parity_optimization, macroeconomic_heuristic,
+    calculate_current_allocation, markowitz_optimization,
+    hrp_optimization, risk_parity_optimization, macroeconomic_heuristic, MACRO_SCENARIOS,
     suggest_rebalance, suggest_new_contribution_allocation
 )
+from ticker_registry import DEFAULT_ASSETS
+from cache_warmer import load_cached_valuation, save_portfolio
+from instrumentation import (
+    start_collection, start_profile, start_stage, timed, to_json, to_prometheus
+)
+from macro_scenarios import WITHIN_CLASS_OPTIMIZERS
+from pipeline import build_portfolio_pipeline, default_data_versions
+from screener import VALUATION_METHODS, align_to_portfolio, screen_universe, screener_to_contribution_inputs
 
 # Configuração da página
 st.set_page_config(
@@ -26,6 +35,25 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
+# Instrumentação: as métricas são do processo, então guardamos uma fotografia no início do rerun
+# e o painel de desempenho mostra apenas o que foi acumulado desde então
+# Métricas apenas deste rerun (outras sessões e o aquecimento em segundo plano ficam de fora)
+stop_rerun_metrics = start_collection()
+stop_rerun_timer = start_stage("app.rerun")
+stop_profile = start_profile() if st.session_state.pop("perf_profile_next", False) else None
+
+@st.cache_data(show_spinner="Consolidando posições do histórico...")
+def positions_from_uploads(uploads):
+    # uploads: tupla (nome, conteúdo) dos arquivos enviados. Memorizado pelo conteúdo: reruns disparados
+    # por outros widgets não releem o histórico inteiro
+    return update_positions_from_files([BytesIO(content) for _, content in uploads])
+
+def render_figure(fig):
+    # Renderização dos gráficos do matplotlib (medida como etapa própria)
+    with timed("app.matplotlib"):
+        st.pyplot(fig)
+        plt.close(fig)
+
 # Título principal
 st.title("📈 Otimizador de Carteira de Investimentos")
 st.markdown("### Análise fundamentalista e otimização quantitativa de portfólio")
@@ -33,18 +61,38 @@ st.markdown("### Análise fundamentalista e otimização quantitativa de portfó
 # Sidebar para configurações
 st.sidebar.header("⚙️ Configurações")
 
+st.sidebar.subheader("🔧 Configurações Avançadas")
+
+# Parâmetros de valuation
+st.sidebar.markdown("**Parâmetros de Valuation**")
+dcf_growth_rate = st.sidebar.slider("Taxa de Crescimento DCF (%)", 0.0, 20.0, 5.0) / 100
+dcf_discount_rate = st.sidebar.slider("Taxa de Desconto DCF (%)", 5.0, 20.0, 10.0) / 100
+bazin_min_yield = st.sidebar.slider("Yield Mínimo Bazin (%)", 3.0, 10.0, 6.0) / 100
+
+# Parâmetros de otimização
+st.sidebar.markdown("**Parâmetros de Otimização**")
+risk_free_rate = st.sidebar.slider("Taxa Livre de Risco (%)", 0.0, 15.0, 5.0,
+                                   help="Também usada como juros de referência (Y) no valuation de Graham") / 100
+max_weight_per_asset = st.sidebar.slider("Peso Máximo por Ativo (%)", 5.0, 50.0, 20.0) / 100
+
+# Etapas do app memorizadas entre reruns: cada widget recalcula apenas as etapas que dependem dele
+pipeline = build_portfolio_pipeline(st.session_state.setdefault("pipeline_cache", {}))
+pipeline.set_inputs(
+    dcf_growth_rate=dcf_growth_rate,
+    dcf_discount_rate=dcf_discount_rate,
+    bazin_min_yield=bazin_min_yield,
+    risk_free_rate=risk_free_rate,
+    max_weight=max_weight_per_asset,
+    **default_data_versions()
+)
+
 # Lista de ativos padrão
-default_assets = {
-    "Ações": ["ITUB3", "TOTS3", "MDIA3", "TAEE3", "BBSE3", "WEGE3", "PSSA3", "EGIE3", "PRIO3", "BBAS3", "BPAC11", "SBSP3", "SAPR4", "CMIG3", "AGRO3", "B3SA3", "VIVT3"],
-    "FIIs": ["MXRF11", "XPIN11", "VISC11", "XPLG11", "HGLG11", "ALZR11", "BCRI11", "HGRU11", "VILG11", "VGHF11", "KNRI11", "HGRE11", "BRCO11", "HGCR11", "VGIA11", "MALL11", "BTLG11", "BTLG12", "XPML11", "LVBI11", "TRXF11"],
-    "Exterior": ["IVV", "QQQM", "QUAL", "XLRE"],
-    "Renda Fixa": ["LCA", "LFT", "LTN", "DEBENTURES"]
-}
+default_assets = DEFAULT_ASSETS
 
 # Seção 1: Upload ou entrada manual da carteira
 st.header("1. 📊 Carteira Atual")
 
-upload_option = st.radio("Como deseja inserir sua carteira?", ["Upload CSV", "Entrada Manual"])
+upload_option = st.radio("Como deseja inserir sua carteira?", ["Upload CSV", "Histórico de Transações (B3)", "Entrada Manual"])
 
 if upload_option == "Upload CSV":
     uploaded_file = st.file_uploader("Faça upload do arquivo CSV da sua carteira", type="csv")
@@ -55,6 +103,16 @@ if upload_option == "Upload CSV":
     else:
         st.info("Por favor, faça upload de um arquivo CSV com as colunas: Ativo, Quantidade, PrecoUnitario")
         portfolio_df = None
+elif upload_option == "Histórico de Transações (B3)":
+    uploaded_files = st.file_uploader("Faça upload dos extratos de negociação e eventos (CSV, em ordem cronológica)",
+                                      type="csv", accept_multiple_files=True)
+    if uploaded_files:
+        portfolio_df = positions_from_uploads(tuple((f.name, f.getvalue()) for f in uploaded_files))
+        st.success("Posições consolidadas a partir do histórico!")
+        st.dataframe(portfolio_df)
+    else:
+        st.info("Por favor, faça upload de arquivos CSV com as colunas: Data do Negócio, Tipo de Movimentação, Código de Negociação, Quantidade, Preço")
+        portfolio_df = None
 else:
     st.subheader("Entrada Manual da Carteira")
     
@@ -84,13 +142,21 @@ else:
         else:
             portfolio_df = None
 
+# Salvar carteira (carteiras salvas entram no aquecimento de cache agendado)
+if portfolio_df is not None:
+    with st.expander("💾 Salvar carteira"):
+        portfolio_name = st.text_input("Nome da carteira", value="minha_carteira")
+        if st.button("Salvar"):
+            saved_path = save_portfolio(portfolio_df, portfolio_name)
+            st.success(f"Carteira salva em {saved_path}")
+
 # Seção 2: Análise Fundamentalista
 if portfolio_df is not None:
     st.header("2. 🔍 Análise Fundamentalista")
     
-    # Adicionar classe de ativos
-    portfolio_df['Classe'] = portfolio_df['Ativo'].apply(identify_asset_class)
-    portfolio_df = calculate_current_allocation(portfolio_df)
+    # Adicionar classe de ativos e alocação atual
+    pipeline.set_inputs(portfolio=portfolio_df[['Ativo', 'Quantidade', 'PrecoUnitario']].reset_index(drop=True))
+    portfolio_df = pipeline.get("allocation")
     
     # Filtros
     col1, col2 = st.columns(2)
@@ -100,6 +166,8 @@ if portfolio_df is not None:
                                         default=portfolio_df['Classe'].unique())
     with col2:
         show_valuation = st.checkbox("Mostrar análise de valuation", value=True)
+        reference_method = st.selectbox("Valor intrínseco de referência", VALUATION_METHODS, index=1)
+    pipeline.set_inputs(reference_method=reference_method)
     
     # Filtrar dados
     filtered_portfolio = portfolio_df[portfolio_df['Classe'].isin(selected_classes)]
@@ -120,41 +188,23 @@ if portfolio_df is not None:
     ax2.pie(class_allocation.values, labels=class_allocation.index, autopct='%1.1f%%')
     ax2.set_title('Alocação por Classe')
     
-    st.pyplot(fig)
+    render_figure(fig)
     
     # Análise de Valuation (se habilitada)
     if show_valuation:
         st.subheader("Análise de Valuation")
         
         # Nota sobre API
-        st.warning("⚠️ Para obter dados reais de valuation, você precisa configurar uma chave da API FMP no arquivo data_fetcher.py")
+        st.warning("⚠️ Para obter dados reais de valuation, defina a variável de ambiente FMP_API_KEY com sua chave da API FMP")
         
-        # Simulação de dados de valuation para demonstração
-        valuation_data = []
-        for _, row in filtered_portfolio.iterrows():
-            asset = row['Ativo']
-            current_price = row['PrecoUnitario']
-            
-            # Valores simulados para demonstração
-            dcf_value = current_price * np.random.uniform(0.8, 1.3)
-            graham_value = current_price * np.random.uniform(0.7, 1.4)
-            bazin_value = current_price * np.random.uniform(0.6, 1.2)
-            
-            # Calcular score de oportunidade (usando DCF como referência)
-            opportunity_score = calculate_opportunity_score(current_price, dcf_value)
-            buy_signal = get_buy_signal(current_price, dcf_value)
-            
-            valuation_data.append({
-                'Ativo': asset,
-                'Preço Atual': current_price,
-                'DCF': dcf_value,
-                'Graham': graham_value,
-                'Bazin': bazin_value,
-                'Score Oportunidade (%)': opportunity_score,
-                'Sinal': buy_signal
-            })
-        
-        valuation_df = pd.DataFrame(valuation_data)
+        # Valuation em lote a partir dos fundamentos em cache (sem chamadas de rede por ativo), com score
+        # de oportunidade e sinal pelo método de referência escolhido
+        valuation_df = pipeline.get("opportunity")
+        valuation_df = valuation_df[portfolio_df['Classe'].isin(selected_classes).to_numpy()]
+        if valuation_df[VALUATION_METHODS].isna().all().all():
+            st.info("Sem fundamentos em cache para estes ativos. Execute o aquecimento de cache para preenchê-los.")
+
+        valuation_df = valuation_df.drop(columns=['Liquidez']).reset_index()
         st.dataframe(valuation_df.round(2))
         
         # Gráfico de scores de oportunidade
@@ -172,7 +222,7 @@ if portfolio_df is not None:
         ax.set_ylabel('Score (%)')
         ax.axhline(y=0, color='black', linestyle='-', alpha=0.3)
         plt.xticks(rotation=45)
-        st.pyplot(fig)
+        render_figure(fig)
 
 # Seção 3: Otimização de Carteira
 if portfolio_df is not None:
@@ -183,42 +233,79 @@ if portfolio_df is not None:
         "Método de Otimização",
         ["Markowitz (Mínima Variância)", "HRP (Hierarchical Risk Parity)", "Risk Parity", "Heurística Macroeconômica"]
     )
+    pipeline.set_inputs(optimization_method=optimization_method)
     
     # Configurações específicas para heurística macroeconômica
     if optimization_method == "Heurística Macroeconômica":
-        scenario = st.selectbox("Cenário Macroeconômico", ["expansionista", "neutro", "restritivo"])
-        
-        # Mostrar alocação ideal por classe
-        ideal_allocation = macroeconomic_heuristic(portfolio_df['Ativo'].tolist(), scenario)
-        
-        st.subheader(f"Alocação Ideal - Cenário {scenario.title()}")
-        allocation_df = pd.DataFrame(list(ideal_allocation.items()), columns=['Classe', 'Alocação Ideal'])
-        st.dataframe(allocation_df)
-        
-        # Gráfico da alocação ideal
-        fig, ax = plt.subplots(figsize=(8, 6))
-        ax.pie(allocation_df['Alocação Ideal'], labels=allocation_df['Classe'], autopct='%1.1f%%')
-        ax.set_title(f'Alocação Ideal - Cenário {scenario.title()}')
-        st.pyplot(fig)
+        # Probabilidades da mistura ponderada de cenários e, opcionalmente, um cenário personalizado
+        st.markdown("**Probabilidade de cada cenário (cenário ponderado)**")
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            prob_expansionista = st.number_input("Expansionista (%)", min_value=0.0, max_value=100.0, value=25.0)
+        with col2:
+            prob_neutro = st.number_input("Neutro (%)", min_value=0.0, max_value=100.0, value=50.0)
+        with col3:
+            prob_restritivo = st.number_input("Restritivo (%)", min_value=0.0, max_value=100.0, value=25.0)
+
+        custom_scenario = None
+        if st.checkbox("Definir cenário personalizado"):
+            class_columns = st.columns(len(MACRO_SCENARIOS.index))
+            custom_scenario = {}
+            for column, asset_class in zip(class_columns, MACRO_SCENARIOS.index):
+                with column:
+                    custom_scenario[asset_class] = st.number_input(
+                        f"{asset_class} (%)", min_value=0.0, max_value=100.0,
+                        value=float(MACRO_SCENARIOS.loc[asset_class, 'neutro'] * 100), key=f"custom_{asset_class}")
+
+        scenario_names = list(MACRO_SCENARIOS.columns) + ["ponderado"] + (["personalizado"] if custom_scenario else [])
+        scenario = st.selectbox("Cenário Macroeconômico", scenario_names, index=1)
+        class_optimization_method = st.selectbox("Pesos dentro de cada classe", list(WITHIN_CLASS_OPTIMIZERS))
+        pipeline.set_inputs(
+            macro_scenario=scenario,
+            scenario_probabilities={'expansionista': prob_expansionista, 'neutro': prob_neutro,
+                                    'restritivo': prob_restritivo},
+            custom_scenario=custom_scenario,
+            class_optimization_method=class_optimization_method,
+        )
+
+        # Alocação por classe de todos os cenários
+        scenario_matrix_df = pipeline.get("scenario_matrix")
+        st.subheader("Alocação por Classe em Cada Cenário")
+        st.dataframe(scenario_matrix_df.style.format("{:.1%}"))
+
+        # Pesos-alvo por ativo de todos os cenários (calculados de uma vez) e comparação com a carteira atual
+        _, returns_from_cache = pipeline.get("returns")
+        if not returns_from_cache:
+            st.info("Preços históricos não estão no cache: pesos iguais dentro de cada classe.")
+        targets_df = pipeline.get("scenario_targets")
+        st.subheader("Pesos-alvo por Ativo em Cada Cenário")
+        st.dataframe(targets_df.style.format("{:.1%}"))
+        st.subheader("Comparação de Cenários")
+        st.dataframe(pipeline.get("scenario_comparison").style.format("{:.1%}"))
+
+        # Gráfico da alocação ideal no cenário escolhido
+        allocation_df = targets_df[scenario].rename('Alocação Ideal').rename_axis('Ativo').reset_index()
+        allocation_df = allocation_df[allocation_df['Alocação Ideal'] > 0]
+        if not allocation_df.empty:
+            fig, ax = plt.subplots(figsize=(8, 6))
+            ax.pie(allocation_df['Alocação Ideal'], labels=allocation_df['Ativo'], autopct='%1.1f%%')
+            ax.set_title(f'Alocação Ideal - Cenário {scenario.title()}')
+            render_figure(fig)
     
     else:
         st.info("Para métodos quantitativos (Markowitz, HRP, Risk Parity), são necessários dados históricos de retorno dos ativos.")
         
-        # Simulação de otimização para demonstração
+        # Depois do primeiro clique, a otimização segue visível e é refeita apenas quando suas
+        # entradas mudam (ex: peso máximo por ativo), partindo da solução anterior
         if st.button("Simular Otimização"):
-            # Criar dados fictícios de retorno para demonstração
-            returns_data = {}
-            for asset in portfolio_df['Ativo']:
-                returns_data[asset] = np.random.normal(0.001, 0.02, 252)  # 252 dias úteis
-            
-            returns_df = pd.DataFrame(returns_data)
-            
-            if optimization_method == "Markowitz (Mínima Variância)":
-                optimal_weights = markowitz_optimization(returns_df)
-            elif optimization_method == "HRP (Hierarchical Risk Parity)":
-                optimal_weights = hrp_optimization(returns_df)
-            else:  # Risk Parity
-                optimal_weights = risk_parity_optimization(returns_df)
+            st.session_state["show_optimization"] = True
+        if st.session_state.get("show_optimization"):
+            # Retornos históricos do cache aquecido; sem cache, dados fictícios para demonstração
+            _, returns_from_cache = pipeline.get("returns")
+            if not returns_from_cache:
+                st.info("Preços históricos não estão no cache: usando retornos fictícios para demonstração "
+                        "(rebalanceamento e aporte usam pesos iguais).")
+            optimal_weights = pipeline.get("optimization")
             
             st.subheader("Pesos Ótimos")
             weights_df = pd.DataFrame({
@@ -233,19 +320,22 @@ if portfolio_df is not None:
             ax.set_title(f'Pesos Ótimos - {optimization_method}')
             ax.set_ylabel('Peso')
             plt.xticks(rotation=45)
-            st.pyplot(fig)
+            render_figure(fig)
 
 # Seção 4: Sugestão de Rebalanceamento
 if portfolio_df is not None:
     st.header("4. 🔄 Sugestão de Rebalanceamento")
     
     allow_sales = st.checkbox("Permitir vendas para rebalanceamento", value=True)
+    pipeline.set_inputs(allow_sales=allow_sales)
     
     if st.button("Gerar Sugestões de Rebalanceamento"):
-        # Para demonstração, usar pesos iguais como ideal
-        ideal_weights = pd.Series(1/len(portfolio_df), index=portfolio_df['Ativo'])
-        
-        rebalance_suggestions = suggest_rebalance(portfolio_df, ideal_weights, allow_sales)
+        # Pesos ideais do método de otimização escolhido na seção 3 (pesos iguais sem preços no cache)
+        _, returns_from_cache = pipeline.get("returns")
+        if not returns_from_cache and optimization_method != "Heurística Macroeconômica":
+            st.warning("Preços históricos não estão no cache: rebalanceamento calculado com pesos iguais, "
+                       "não com a otimização. Aqueça o cache (cache_warmer) para usar os pesos ótimos.")
+        rebalance_suggestions = pipeline.get("rebalance")
         
         if not rebalance_suggestions.empty:
             st.subheader("Sugestões de Rebalanceamento")
@@ -268,17 +358,41 @@ if portfolio_df is not None:
     st.header("5. 💸 Alocação de Novos Aportes")
     
     new_contribution = st.number_input("Valor do novo aporte (R$)", min_value=0.0, value=1000.0)
+    pipeline.set_inputs(new_contribution=new_contribution)
     
+    use_screener = st.checkbox("Considerar oportunidades de todo o universo (screener)", value=False)
+    if use_screener:
+        col1, col2, col3 = st.columns(3)
+        with col1:
+            screener_top_k = st.number_input("Número de ativos (top-k)", min_value=1, max_value=100, value=10)
+        with col2:
+            screener_classes = st.multiselect("Classes", ["Ações", "Ações (Units)", "FII", "ETF",
+                                                           "ETF (Exterior)", "ETF (Renda Fixa)", "Exterior"],
+                                              default=["Ações", "FII"])
+        with col3:
+            screener_min_liquidity = st.number_input("Liquidez média mínima (R$)", min_value=0.0, value=0.0)
+
     if st.button("Sugerir Alocação do Aporte"):
-        # Para demonstração, usar pesos iguais como ideal
-        ideal_weights = pd.Series(1/len(portfolio_df), index=portfolio_df['Ativo'])
-        
-        # Simular scores de valuation (em um cenário real, viria da análise fundamentalista)
-        valuation_scores = {asset: np.random.uniform(-20, 30) for asset in portfolio_df['Ativo']}
-        
-        allocation_suggestions = suggest_new_contribution_allocation(
-            portfolio_df, ideal_weights, new_contribution, valuation_scores
-        )
+        if use_screener:
+            # Pesos ideais e scores vindos do ranking do universo inteiro
+            screen_df = screen_universe(top_k=int(screener_top_k), method=reference_method,
+                                        classes=screener_classes, min_liquidity=screener_min_liquidity,
+                                        precomputed=load_cached_valuation())
+            # Ativos já na carteira passam a usar o mesmo rótulo dela (evita valor atual zero e linha duplicada)
+            screen_df = align_to_portfolio(screen_df, portfolio_df['Ativo'])
+            st.subheader("Melhores Oportunidades do Universo")
+            st.dataframe(screen_df.round(2))
+            ideal_weights, valuation_scores = screener_to_contribution_inputs(screen_df)
+            allocation_suggestions = suggest_new_contribution_allocation(
+                portfolio_df, ideal_weights, new_contribution, valuation_scores
+            )
+        else:
+            # Pesos ideais da otimização (seção 3, pesos iguais sem preços no cache) e scores de valuation da seção 2
+            _, returns_from_cache = pipeline.get("returns")
+            if not returns_from_cache and optimization_method != "Heurística Macroeconômica":
+                st.warning("Preços históricos não estão no cache: aporte calculado com pesos iguais, "
+                           "não com a otimização. Aqueça o cache (cache_warmer) para usar os pesos ótimos.")
+            allocation_suggestions = pipeline.get("contribution")
         
         if not allocation_suggestions.empty:
             st.subheader("Sugestão de Alocação do Aporte")
@@ -290,7 +404,7 @@ if portfolio_df is not None:
             ax.set_title('Alocação Sugerida do Novo Aporte')
             ax.set_ylabel('Valor (R$)')
             plt.xticks(rotation=45)
-            st.pyplot(fig)
+            render_figure(fig)
             
             # Carteira após aporte
             st.subheader("Carteira Após Aporte")
@@ -299,10 +413,17 @@ if portfolio_df is not None:
             for _, row in allocation_suggestions.iterrows():
                 asset = row['Ativo']
                 value_allocated = row['ValorAlocado']
-                asset_price = portfolio_df[portfolio_df['Ativo'] == asset]['PrecoUnitario'].iloc[0]
-                additional_quantity = value_allocated / asset_price
-                
-                portfolio_after.loc[portfolio_after['Ativo'] == asset, 'Quantidade'] += additional_quantity
+                if asset in portfolio_df['Ativo'].values:
+                    asset_price = portfolio_df[portfolio_df['Ativo'] == asset]['PrecoUnitario'].iloc[0]
+                    additional_quantity = value_allocated / asset_price
+                    
+                    portfolio_after.loc[portfolio_after['Ativo'] == asset, 'Quantidade'] += additional_quantity
+                elif use_screener and asset in screen_df.index:
+                    # Novo ativo vindo do screener: entra na carteira pelo preço em cache
+                    asset_price = screen_df.loc[asset, 'Preço Atual']
+                    new_row = {'Ativo': asset, 'Quantidade': value_allocated / asset_price,
+                               'PrecoUnitario': asset_price, 'Classe': screen_df.loc[asset, 'Classe']}
+                    portfolio_after = pd.concat([portfolio_after, pd.DataFrame([new_row])], ignore_index=True)
             
             portfolio_after['ValorTotal'] = portfolio_after['Quantidade'] * portfolio_after['PrecoUnitario']
             portfolio_after = calculate_current_allocation(portfolio_after)
@@ -348,21 +469,6 @@ Este sistema oferece:
 ⚠️ **Importante**: Este é um sistema de apoio à decisão. Sempre consulte um profissional qualificado antes de tomar decisões de investimento.
 """)
 
-# Configurações avançadas na sidebar
-st.sidebar.markdown("---")
-st.sidebar.subheader("🔧 Configurações Avançadas")
-
-# Parâmetros de valuation
-st.sidebar.markdown("**Parâmetros de Valuation**")
-dcf_growth_rate = st.sidebar.slider("Taxa de Crescimento DCF (%)", 0.0, 20.0, 5.0) / 100
-dcf_discount_rate = st.sidebar.slider("Taxa de Desconto DCF (%)", 5.0, 20.0, 10.0) / 100
-bazin_min_yield = st.sidebar.slider("Yield Mínimo Bazin (%)", 3.0, 10.0, 6.0) / 100
-
-# Parâmetros de otimização
-st.sidebar.markdown("**Parâmetros de Otimização**")
-risk_free_rate = st.sidebar.slider("Taxa Livre de Risco (%)", 0.0, 15.0, 5.0) / 100
-max_weight_per_asset = st.sidebar.slider("Peso Máximo por Ativo (%)", 5.0, 50.0, 20.0) / 100
-
 # Informações sobre APIs
 st.sidebar.markdown("---")
 st.sidebar.subheader("🔑 Configuração de APIs")
@@ -370,6 +476,39 @@ st.sidebar.markdown("""
 Para obter dados reais:
 1. **FMP API**: Cadastre-se em financialmodelingprep.com
 2. **Yahoo Finance**: Use a biblioteca yfinance
-3. Configure as chaves no arquivo `data_fetcher.py`
+3. Defina a chave na variável de ambiente `FMP_API_KEY`
+4. Para rodar offline, use `DATA_PROVIDER=replay:<arquivo.zip>` ou `DATA_PROVIDER=synthetic`
 """)
 
+
+# Painel de desempenho
+stop_rerun_timer()
+rerun_metrics = stop_rerun_metrics()
+if stop_profile is not None:
+    st.session_state["perf_profile_report"] = stop_profile()
+
+st.sidebar.markdown("---")
+with st.sidebar.expander("⏱️ Desempenho (último rerun)"):
+    if rerun_metrics["stages"]:
+        stages_df = pd.DataFrame(rerun_metrics["stages"]).T.sort_values("seconds", ascending=False)
+        stages_df.index.name = "Etapa"
+        st.dataframe(stages_df.round(4))
+    if rerun_metrics["counters"]:
+        counters_df = pd.DataFrame(list(rerun_metrics["counters"].items()), columns=["Contador", "Valor"])
+        st.dataframe(counters_df, hide_index=True)
+
+    st.download_button("Exportar JSON", to_json(rerun_metrics), file_name="metricas.json", mime="application/json")
+    # Prometheus: contadores acumulados do processo inteiro (todas as sessões), como esperado pelo scraper
+    st.download_button("Exportar Prometheus (processo)", to_prometheus(), file_name="metricas.prom",
+                       mime="text/plain")
+
+    if st.button("Perfilar próximo rerun (cProfile + tracemalloc)"):
+        st.session_state["perf_profile_next"] = True
+        st.rerun()
+
+    profile_report = st.session_state.get("perf_profile_report")
+    if profile_report:
+        st.markdown(f"**Memória**: pico {profile_report['memory_peak_mb']:.1f} MB")
+        st.text(profile_report["cprofile"][:5000])
+        st.download_button("Baixar relatório de perfil", to_json(profile_report), file_name="perfil.json",
+                           mime="application/json")
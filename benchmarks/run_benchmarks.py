@@ -0,0 +1,280 @@
+import argparse
+import atexit
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+import pandas as pd
+
+# Suíte de benchmarks dos caminhos críticos: busca (contra um servidor FMP local), valuation,
+# covariância, otimizadores e rotinas de alocação, sobre universos sintéticos de 10 a 5.000 ativos
+# e livros com muitas contas. Mede tempo (melhor de N execuções) e pico de memória (tracemalloc),
+# e salva/compara baselines para detectar regressões.
+#
+# Uso:
+#   python benchmarks/run_benchmarks.py --save                # roda e grava a baseline
+#   python benchmarks/run_benchmarks.py --compare             # roda e compara com a baseline
+#   python benchmarks/run_benchmarks.py --sizes 10 100 --cases valuation.batch covariance
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+# Isola os caches da suíte antes de importar os módulos do projeto
+_work_dir = tempfile.mkdtemp(prefix="bench_")
+atexit.register(shutil.rmtree, _work_dir, ignore_errors=True)
+os.environ["FUNDAMENTALS_STORE_DIR"] = os.path.join(_work_dir, "fundamentals")
+os.environ["SINGLEFLIGHT_DIR"] = os.path.join(_work_dir, "singleflight")
+# Sem reaproveitamento entre execuções: cada repetição de fetch.stub faz as requisições de fato
+os.environ["SINGLEFLIGHT_TTL"] = "0"
+os.environ["DATA_PROVIDER"] = "synthetic"
+
+import data_fetcher  # noqa: E402
+from data_providers import SyntheticProvider  # noqa: E402
+from fundamentals_store import store_profiles_bulk, upsert_statements_bulk  # noqa: E402
+from macro_scenarios import scenario_targets  # noqa: E402
+from portfolio_optimizer import (  # noqa: E402
+    calculate_current_allocation, hrp_optimization, markowitz_optimization, risk_parity_optimization,
+    suggest_new_contribution_allocation, suggest_rebalance,
+)
+from screener import screen_universe  # noqa: E402
+from valuation import batch_valuation, calculate_graham_valuation  # noqa: E402
+
+DEFAULT_SIZES = [10, 100, 1000, 5000]
+DEFAULT_BASELINE = os.path.join(ROOT_DIR, "benchmarks", "baselines", "baseline.json")
+
+# Tamanho máximo de universo por caso (evita execuções de horas); --full remove os limites
+CASE_LIMITS = {
+    "fetch.stub": 1000,
+    "valuation.scalar": 1000,
+    "optimizer.markowitz": 100,
+    "scenarios.targets": 100,
+}
+
+# Diferença absoluta mínima (s) para considerar regressão, abaixo disso é ruído de medição
+NOISE_FLOOR = 0.001
+
+def synthetic_tickers(n):
+    # Códigos no formato da B3 (4 letras + 3), classificados como ações pelo cadastro
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return ["".join(chars) + "3" for chars in itertools.islice(itertools.product(letters, repeat=4), n)]
+
+def synthetic_returns(tickers, days=252, seed=0):
+    rng = np.random.default_rng(seed)
+    # Fator de mercado comum + ruído idiossincrático, para uma covariância realista
+    market = rng.normal(0.0004, 0.01, (days, 1))
+    betas = rng.uniform(0.5, 1.5, len(tickers))
+    noise = rng.normal(0, 0.015, (days, len(tickers)))
+    return pd.DataFrame(market * betas + noise, columns=tickers)
+
+# --- Servidor FMP local ---
+
+class _StubHandler(BaseHTTPRequestHandler):
+    provider = SyntheticProvider(seed=0)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        query = parse_qs(url.query)
+        if len(parts) < 2:
+            self.send_error(404)
+            return
+        endpoint, ticker = parts[-2], parts[-1]
+        if endpoint == "profile":
+            payload = [self.provider.get_company_profile(ticker)]
+        else:
+            limit = int(query["limit"][0]) if "limit" in query else None
+            period = query.get("period", ["annual"])[0]
+            statements = self.provider.get_financial_statements(ticker, endpoint, period, limit)
+            payload = statements.to_dict(orient="records")
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stub_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# --- Preparação dos dados ---
+
+def populate_store(tickers):
+    provider = SyntheticProvider(seed=0)
+    for statement_type in ("income-statement", "balance-sheet-statement", "cash-flow-statement"):
+        upsert_statements_bulk(statement_type, {
+            ticker + ".SA": provider.get_financial_statements(ticker, statement_type, "annual", 3)
+            for ticker in tickers
+        })
+    store_profiles_bulk({ticker + ".SA": provider.get_company_profile(ticker) for ticker in tickers})
+
+def build_book(tickers, accounts, holdings_per_account=20, seed=0):
+    # Livro de carteiras: cada conta tem um subconjunto do universo e pesos ideais iguais
+    rng = np.random.default_rng(seed)
+    book = []
+    for _ in range(accounts):
+        holdings = rng.choice(tickers, size=min(holdings_per_account, len(tickers)), replace=False)
+        portfolio_df = pd.DataFrame({
+            "Ativo": holdings,
+            "Quantidade": rng.integers(1, 1000, len(holdings)).astype(float),
+            "PrecoUnitario": rng.uniform(5, 100, len(holdings)),
+        })
+        portfolio_df = calculate_current_allocation(portfolio_df)
+        ideal_weights = pd.Series(1 / len(holdings), index=holdings)
+        scores = dict(zip(holdings, rng.uniform(-20, 30, len(holdings))))
+        book.append((portfolio_df, ideal_weights, scores))
+    return book
+
+# --- Casos ---
+
+def case_fetch(tickers, server):
+    def run():
+        for ticker in tickers:
+            data_fetcher.get_company_profile(ticker)
+            data_fetcher.get_financial_statements(ticker, "income-statement", "annual")
+
+    def setup():
+        data_fetcher.FMP_BASE_URL = f"http://127.0.0.1:{server.server_address[1]}"
+        data_fetcher.FMP_API_KEY = "benchmark"
+        data_fetcher.set_provider("live")
+
+    def teardown():
+        data_fetcher.set_provider("synthetic")
+    return run, setup, teardown
+
+def build_cases(size, accounts, server):
+    tickers = synthetic_tickers(size)
+    store_keys = [ticker + ".SA" for ticker in tickers]
+    returns_df = synthetic_returns(tickers)
+    book = build_book(tickers, accounts)
+    # Universo dividido entre as classes dos cenários, para que cada classe tenha sua otimização
+    scenario_classes = np.resize(["Ações", "FII", "Exterior", "Renda Fixa"], size)
+
+    cases = {
+        "fetch.stub": case_fetch(tickers, server),
+        "valuation.batch": (lambda: batch_valuation(store_keys), None, None),
+        "valuation.scalar": (lambda: [calculate_graham_valuation(ticker) for ticker in store_keys], None, None),
+        "screener.top_k": (lambda: screen_universe(tickers, top_k=20), None, None),
+        "covariance": (lambda: returns_df.cov(), None, None),
+        "optimizer.markowitz": (lambda: markowitz_optimization(returns_df), None, None),
+        "optimizer.hrp": (lambda: hrp_optimization(returns_df), None, None),
+        "optimizer.risk_parity": (lambda: risk_parity_optimization(returns_df), None, None),
+        "scenarios.targets": (lambda: scenario_targets(
+            returns_df, scenario_classes,
+            blends={"ponderado": {"expansionista": 0.25, "neutro": 0.5, "restritivo": 0.25}},
+            custom={"personalizado": {"Ações": 0.5, "FII": 0.3, "Renda Fixa": 0.2}}), None, None),
+        "allocation.rebalance": (
+            lambda: [suggest_rebalance(portfolio_df, weights) for portfolio_df, weights, _ in book], None, None),
+        "allocation.contribution": (
+            lambda: [suggest_new_contribution_allocation(portfolio_df, weights, 10_000.0, scores)
+                     for portfolio_df, weights, scores in book], None, None),
+    }
+    return tickers, cases
+
+def measure(func, repeat):
+    # Pico de memória em uma execução com tracemalloc; tempo = melhor de 'repeat' execuções sem ele
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return {"seconds": min(timings), "mean_seconds": float(np.mean(timings)), "peak_mb": peak / 2 ** 20}
+
+def run_suite(sizes, accounts, repeat, selected_cases=None, full=False):
+    server = start_stub_server()
+    results = {}
+    try:
+        for size in sizes:
+            tickers, cases = build_cases(size, accounts, server)
+            populate_store(tickers)
+            for name, (func, setup, teardown) in cases.items():
+                if selected_cases and name not in selected_cases:
+                    continue
+                if not full and size > CASE_LIMITS.get(name, size):
+                    print(f"{name}[{size}]: ignorado (limite {CASE_LIMITS[name]}; use --full)")
+                    continue
+                if setup:
+                    setup()
+                try:
+                    result = measure(func, repeat)
+                finally:
+                    if teardown:
+                        teardown()
+                results[f"{name}[{size}]"] = result
+                print(f"{name}[{size}]: {result['seconds'] * 1000:.2f} ms, pico {result['peak_mb']:.2f} MB")
+    finally:
+        server.shutdown()
+    return results
+
+def save_baseline(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    payload = {
+        "created": pd.Timestamp.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "machine": platform.platform(),
+        "results": results,
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(payload, f, indent=2)
+    print(f"\nBaseline gravada em {path}")
+
+def compare_with_baseline(results, path, tolerance):
+    # Retorna a lista de casos cujo tempo piorou mais que 'tolerance' em relação à baseline
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+
+    regressions = []
+    print(f"\n{'Caso':40s} {'Baseline (ms)':>14s} {'Atual (ms)':>12s} {'Razão':>8s}")
+    for key, result in results.items():
+        if key not in baseline:
+            continue
+        old, new = baseline[key]["seconds"], result["seconds"]
+        ratio = new / old if old > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + tolerance and new - old > NOISE_FLOOR:
+            regressions.append(key)
+            flag = "  <-- regressão"
+        print(f"{key:40s} {old * 1000:14.2f} {new * 1000:12.2f} {ratio:8.2f}{flag}")
+    return regressions
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmarks de valuation, otimização e alocação")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="tamanhos de universo")
+    parser.add_argument("--accounts", type=int, default=100, help="número de contas no livro de carteiras")
+    parser.add_argument("--repeat", type=int, default=3, help="execuções por caso (vale a melhor)")
+    parser.add_argument("--cases", nargs="+", help="apenas os casos indicados (ex: covariance valuation.batch)")
+    parser.add_argument("--full", action="store_true", help="ignora os limites de tamanho por caso")
+    parser.add_argument("--save", nargs="?", const=DEFAULT_BASELINE, help="grava os resultados como baseline")
+    parser.add_argument("--compare", nargs="?", const=DEFAULT_BASELINE, help="compara com uma baseline gravada")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="piora relativa aceita antes de acusar regressão")
+    parser.add_argument("--output", help="grava os resultados desta execução em JSON")
+    args = parser.parse_args()
+
+    suite_results = run_suite(args.sizes, args.accounts, args.repeat, args.cases, args.full)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(suite_results, f, indent=2)
+    if args.save:
+        save_baseline(suite_results, args.save)
+    if args.compare:
+        if compare_with_baseline(suite_results, args.compare, args.tolerance):
+            sys.exit(1)
@@ -0,0 +1,201 @@
+import argparse
+import glob
+import os
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from data_fetcher import get_company_profile, get_historical_prices
+from instrumentation import increment, timed
+from fundamentals_store import refresh_annual, refresh_universe, store_profiles_bulk
+from screener import default_universe
+from singleflight import purge_shared_results
+from ticker_registry import lookup_tickers
+from valuation import batch_valuation
+
+# Aquecimento de cache: pré-busca perfis, demonstrativos e preços do universo padrão e de todas as
+# carteiras salvas, e persiste os preços de fechamento, a tabela de valuation (parâmetros padrão, lida pelo
+# screener) e a matriz de covariância já calculadas.
+# Assim as sessões interativas começam com dados quentes, sem chamadas de rede.
+
+CACHE_DIR = os.environ.get("MARKET_CACHE_DIR", os.path.join("data", "cache"))
+PORTFOLIOS_DIR = os.environ.get("PORTFOLIOS_DIR", os.path.join("data", "portfolios"))
+WARM_INTERVAL_HOURS = float(os.environ.get("WARM_INTERVAL_HOURS", "6"))
+
+PRICES_FILE = "prices.arrow"
+VALUATION_FILE = "valuation.arrow"
+COVARIANCE_FILE = "covariance.arrow"
+
+# Classes sem perfil/demonstrativos/cotação nos provedores: tratadas como caixa (retorno e variância zero).
+# "Outros" (ex: ações americanas fora do cadastro) é aquecida como qualquer ticker de mercado; sem preços
+# no cache, fica descoberta (e o app usa o aviso de dados fictícios)
+CASH_CLASSES = {"Renda Fixa"}
+
+def _write_frame(df, filename):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, filename)
+    tmp_path = f"{path}.tmp"
+    feather.write_feather(pa.Table.from_pandas(df.reset_index(), preserve_index=False), tmp_path,
+                          compression="uncompressed")
+    os.replace(tmp_path, path)
+
+def _read_frame(filename, index_column, columns=None):
+    path = os.path.join(CACHE_DIR, filename)
+    if not os.path.exists(path):
+        return None
+    if columns is not None:
+        table = feather.read_table(path, memory_map=True)
+        columns = [index_column] + [col for col in columns if col in table.column_names]
+        return table.select(columns).to_pandas().set_index(index_column)
+    return feather.read_table(path, memory_map=True).to_pandas().set_index(index_column)
+
+def save_portfolio(portfolio_df, name):
+    # Carteiras salvas entram automaticamente no universo do aquecimento
+    os.makedirs(PORTFOLIOS_DIR, exist_ok=True)
+    path = os.path.join(PORTFOLIOS_DIR, f"{name}.csv")
+    portfolio_df[["Ativo", "Quantidade", "PrecoUnitario"]].to_csv(path, index=False)
+    return path
+
+def saved_portfolio_tickers():
+    tickers = []
+    for path in glob.glob(os.path.join(PORTFOLIOS_DIR, "*.csv")):
+        try:
+            tickers.extend(pd.read_csv(path, usecols=["Ativo"])["Ativo"].dropna().astype(str))
+        except Exception as e:
+            print(f"[Cache] Erro ao ler carteira salva {path}: {e}")
+    return tickers
+
+def warm_universe_tickers():
+    # Universo padrão + carteiras salvas, normalizado e sem classes sem dados de mercado
+    info = lookup_tickers(default_universe(include_stored=False) + saved_portfolio_tickers())
+    info = info[~info["Simbolo"].duplicated() & ~info["Classe"].isin(CASH_CLASSES)]
+    return (info["Simbolo"] + info["Sufixo"]).tolist()
+
+def _close_prices(prices_df, ticker):
+    if prices_df is None or prices_df.empty or "Close" not in prices_df:
+        return None
+    close = prices_df["Close"]
+    # Versões recentes do yfinance retornam colunas (campo, ticker) mesmo para um único ticker
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    return close.rename(ticker)
+
+def _fetch_each(fetch, tickers, what):
+    # {ticker: resultado} de uma busca por ticker; erros de um ticker não interrompem o ciclo
+    results = {}
+    for ticker in tickers:
+        try:
+            results[ticker] = fetch(ticker)
+        except Exception as e:
+            print(f"[Cache] Erro ao buscar {what} de {ticker}: {e}")
+    return results
+
+def _cash_like(tickers):
+    # Máscara dos tickers tratados como caixa (renda fixa)
+    return lookup_tickers(list(tickers))["Classe"].isin(CASH_CLASSES).to_numpy()
+
+def precompute_covariance(prices_df):
+    # Covariância anualizada dos retornos diários (mesma base usada pelos otimizadores)
+    returns = prices_df.sort_index().pct_change(fill_method=None).dropna(how="all")
+    covariance = returns.cov() * 252
+    covariance.index.name = "Ativo"
+    return covariance
+
+@timed("cache.warm")
+def warm_cache(tickers=None, price_period="1y"):
+    # Executa um ciclo completo de aquecimento e retorna o número de tickers processados
+    tickers = warm_universe_tickers() if tickers is None else list(tickers)
+    started = time.perf_counter()
+    # Uma regravação por arquivo do armazenamento no ciclo inteiro: perfis, anuais (histórico completo
+    # apenas para tickers novos) e trimestrais/TTM (apenas trimestres novos)
+    store_profiles_bulk(_fetch_each(get_company_profile, tickers, "perfil"))
+    refresh_annual(tickers)
+    refresh_universe(tickers)
+
+    prices = _fetch_each(lambda ticker: get_historical_prices(ticker, period=price_period), tickers, "preços")
+    closes = [close for close in (_close_prices(df, ticker) for ticker, df in prices.items()) if close is not None]
+    if closes:
+        prices_df = pd.concat(closes, axis=1)
+        prices_df.index = pd.to_datetime(prices_df.index).tz_localize(None)
+        prices_df.index.name = "Data"
+        _write_frame(prices_df, PRICES_FILE)
+        _write_frame(precompute_covariance(prices_df), COVARIANCE_FILE)
+
+    _write_frame(batch_valuation(tickers).rename_axis("Ativo"), VALUATION_FILE)
+    purge_shared_results()
+    print(f"[Cache] {len(tickers)} tickers aquecidos em {time.perf_counter() - started:.1f}s")
+    return len(tickers)
+
+# --- Leitura do cache pelas sessões interativas ---
+
+def load_cached_prices(tickers=None):
+    return _read_frame(PRICES_FILE, "Data", columns=tickers)
+
+def load_cached_returns(tickers):
+    # Retornos diários dos tickers cobertos, na ordem pedida: os com preço em cache e os de renda fixa
+    # (retorno zero, como caixa). Tickers de mercado ausentes do cache ficam de fora; None sem cache
+    tickers = list(tickers)
+    prices_df = load_cached_prices(tickers)
+    if prices_df is None:
+        increment("cache_misses", cache="prices")
+        return None
+    returns_df = prices_df.pct_change(fill_method=None).dropna()
+    cash = [ticker for ticker, is_cash in zip(tickers, _cash_like(tickers)) if is_cash and ticker not in returns_df]
+    returns_df = returns_df.assign(**{ticker: 0.0 for ticker in cash})
+    covered = [ticker for ticker in tickers if ticker in returns_df.columns]
+    increment("cache_hits" if len(covered) == len(tickers) else "cache_misses", cache="prices")
+    return returns_df[covered]
+
+def load_cached_covariance(tickers):
+    # Covariância anualizada pré-calculada, na ordem pedida; linhas/colunas dos tickers de renda fixa
+    # zeradas. None se algum ticker de mercado não estiver no cache
+    tickers = list(tickers)
+    covariance = _read_frame(COVARIANCE_FILE, "Ativo", columns=tickers)
+    if covariance is None:
+        return None
+    covariance = covariance.reindex(index=tickers, columns=tickers)
+    cash = _cash_like(tickers)
+    covariance.iloc[cash, :] = 0.0
+    covariance.iloc[:, cash] = 0.0
+    if covariance.isna().to_numpy().any():
+        return None
+    return covariance
+
+def load_cached_valuation():
+    # Tabela de valuation do último aquecimento (parâmetros padrão de batch_valuation), indexada por ticker
+    return _read_frame(VALUATION_FILE, "Ativo")
+
+# --- Agendamento ---
+
+def run_scheduler(interval_hours=WARM_INTERVAL_HOURS, stop_event=None, **kwargs):
+    # Executa warm_cache a cada interval_hours até stop_event ser sinalizado
+    stop_event = stop_event or threading.Event()
+    while not stop_event.is_set():
+        try:
+            warm_cache(**kwargs)
+        except Exception as e:
+            print(f"[Cache] Erro no ciclo de aquecimento: {e}")
+        stop_event.wait(interval_hours * 3600)
+
+def start_background_warmer(interval_hours=WARM_INTERVAL_HOURS, **kwargs):
+    # Inicia o agendador em uma thread daemon; retorna o Event que interrompe o agendador
+    stop_event = threading.Event()
+    thread = threading.Thread(target=run_scheduler, args=(interval_hours, stop_event), kwargs=kwargs,
+                              name="cache-warmer", daemon=True)
+    thread.start()
+    return stop_event
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Aquecimento do cache de dados de mercado")
+    parser.add_argument("--once", action="store_true", help="executa um único ciclo e encerra")
+    parser.add_argument("--interval", type=float, default=WARM_INTERVAL_HOURS, help="intervalo entre ciclos, em horas")
+    parser.add_argument("--period", default="1y", help="janela de preços históricos (ex: 1y, 2y)")
+    parser.add_argument("tickers", nargs="*", help="tickers específicos (padrão: universo + carteiras salvas)")
+    args = parser.parse_args()
+
+    tickers = args.tickers or None
+    if args.once:
+        warm_cache(tickers=tickers, price_period=args.period)
+    else:
+        run_scheduler(args.interval, tickers=tickers, price_period=args.period)
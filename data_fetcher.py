@@ -1,32 +1,181 @@
+import contextvars
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+import numpy as np
 import requests
 import pandas as pd
 import yfinance as yf
+from instrumentation import increment, timed
+from data_providers import DataProvider, RecordingProvider, ReplayProvider, SyntheticProvider
+from singleflight import call_once
+from ticker_registry import lookup_ticker
 
-FMP_API_KEY = '7a2Rn70FJUAnnDH0EV4YmHIsrGMCPo95'
+# Chave do FMP lida do ambiente; sem chave, o provedor ao vivo usa apenas o yfinance
+FMP_API_KEY = os.environ.get('FMP_API_KEY', '')
+FMP_BASE_URL = os.environ.get('FMP_BASE_URL', 'https://financialmodelingprep.com/api/v3')
+
+# Provedor de dados: live (padrão), record:<arquivo.zip>, replay:<arquivo.zip> ou synthetic[:semente]
+DATA_PROVIDER = os.environ.get('DATA_PROVIDER', 'live')
+
+# --- Política de resiliência das chamadas ao FMP ---
+FMP_TIMEOUT = 10
+# Retentativas com backoff exponencial (e jitter) quando o FMP responde 429 (limite de requisições)
+FMP_MAX_RETRIES = 3
+FMP_BACKOFF_BASE = 0.5
+# Requisição "hedged": se o FMP não responder até o p95 das latências recentes, o fallback do
+# yfinance é disparado em paralelo e vale a primeira resposta válida
+HEDGE_DEFAULT_DELAY = 2.0
+HEDGE_MIN_DELAY = 0.3
+HEDGE_MIN_SAMPLES = 20
+# Circuit breaker: após falhas consecutivas, o FMP é ignorado durante o período de resfriamento
+CIRCUIT_FAILURE_THRESHOLD = 5
+CIRCUIT_COOLDOWN = 60
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="data-fetcher")
+_state_lock = threading.Lock()
+_fmp_latencies = deque(maxlen=200)
+_circuit = {"failures": 0, "open_until": 0.0}
+
+# Nomes das linhas dos demonstrativos do yfinance -> campos equivalentes do FMP
+YF_STATEMENT_FIELDS = {
+    'income-statement': {
+        'Total Revenue': 'revenue',
+        'Gross Profit': 'grossProfit',
+        'Operating Income': 'operatingIncome',
+        'EBITDA': 'ebitda',
+        'Net Income': 'netIncome',
+        'Basic EPS': 'eps',
+        'Diluted EPS': 'epsdiluted',
+    },
+    'balance-sheet-statement': {
+        'Total Assets': 'totalAssets',
+        'Total Liabilities Net Minority Interest': 'totalLiabilities',
+        'Stockholders Equity': 'totalEquity',
+        'Total Debt': 'totalDebt',
+        'Cash Cash Equivalents And Short Term Investments': 'cashAndShortTermInvestments',
+    },
+    'cash-flow-statement': {
+        'Operating Cash Flow': 'operatingCashFlow',
+        'Capital Expenditure': 'capitalExpenditure',
+        'Free Cash Flow': 'freeCashFlow',
+        'Cash Dividends Paid': 'dividendsPaid',
+    },
+}
 
 def add_sa_suffix_if_needed(ticker):
-    ticker = ticker.upper()
-    if (
-        not ticker.endswith(".SA") and
-        any(ticker.endswith(suf) for suf in ["3", "4", "11"]) and
-        len(ticker) in [5, 6]
-    ):
-        return ticker + ".SA"
-    return ticker
+    # Sufixo de bolsa definido pelo cadastro central (ver ticker_registry.normalize_tickers para colunas)
+    info = lookup_ticker(ticker)
+    return info["Simbolo"] + info["Sufixo"]
 
-def get_company_profile(ticker):
-    try:
-        # Ticker original para FMP
-        url = f"https://financialmodelingprep.com/api/v3/profile/{ticker}?apikey={FMP_API_KEY}"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200:
+def _circuit_open():
+    with _state_lock:
+        return time.monotonic() < _circuit["open_until"]
+
+def _record_fmp_success(latency):
+    with _state_lock:
+        _fmp_latencies.append(latency)
+        _circuit["failures"] = 0
+
+def _record_fmp_failure():
+    with _state_lock:
+        _circuit["failures"] += 1
+        if _circuit["failures"] >= CIRCUIT_FAILURE_THRESHOLD:
+            _circuit["open_until"] = time.monotonic() + CIRCUIT_COOLDOWN
+            _circuit["failures"] = 0
+            increment("circuit_breaker_opened")
+            print(f"[FMP] Circuito aberto: FMP ignorado por {CIRCUIT_COOLDOWN}s")
+
+def _hedge_delay():
+    # p95 das latências recentes do FMP (com poucas amostras, usa o valor padrão)
+    with _state_lock:
+        latencies = list(_fmp_latencies)
+    if len(latencies) < HEDGE_MIN_SAMPLES:
+        return HEDGE_DEFAULT_DELAY
+    return float(min(max(np.percentile(latencies, 95), HEDGE_MIN_DELAY), FMP_TIMEOUT))
+
+def _fmp_get(url):
+    # GET no FMP com backoff em 429 e registro no circuit breaker; retorna a lista JSON ou None.
+    # Corpo que não é JSON, ou JSON que não é lista (ex: {"Error Message": ...} com status 200), conta como falha
+    if _circuit_open():
+        return None
+    for attempt in range(FMP_MAX_RETRIES + 1):
+        started = time.monotonic()
+        increment("network_calls", provider="fmp")
+        try:
+            response = requests.get(url, timeout=FMP_TIMEOUT)
+        except Exception as e:
+            print(f"[FMP] Erro na requisição: {e}")
+            _record_fmp_failure()
+            return None
+
+        if response.status_code == 429 and attempt < FMP_MAX_RETRIES:
+            retry_after = response.headers.get("Retry-After")
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else FMP_BACKOFF_BASE * 2 ** attempt
+            time.sleep(delay + random.uniform(0, FMP_BACKOFF_BASE))
+            continue
+        if response.status_code != 200:
+            print(f"[FMP] Status {response.status_code}")
+            _record_fmp_failure()
+            return None
+
+        try:
             data = response.json()
-            if data:
-                return data[0]
+        except ValueError as e:
+            print(f"[FMP] Resposta inválida: {e}")
+            _record_fmp_failure()
+            return None
+        if not isinstance(data, list):
+            print(f"[FMP] Resposta inesperada: {str(data)[:200]}")
+            _record_fmp_failure()
+            return None
+
+        _record_fmp_success(time.monotonic() - started)
+        return data
+    return None
+
+def _future_result(future):
+    # Resultado de uma das pernas do hedge; exceção conta como resposta vazia (a outra perna segue valendo)
+    try:
+        return future.result()
     except Exception as e:
-        print(f"[FMP] Erro ao buscar profile: {e}")
+        print(f"[FMP] Erro na chamada com hedge: {e}")
+        return None
 
+def _hedged_call(primary, fallback):
+    # Executa primary (FMP); se não responder dentro do prazo hedge, dispara fallback em paralelo.
+    # Retorna o primeiro resultado válido (não None) entre os dois.
+    if not FMP_API_KEY or _circuit_open():
+        return fallback()
+
+    # Cópia do contexto: métricas das chamadas em paralelo contam na coleta de quem pediu (ex: o rerun)
+    pending = {_executor.submit(contextvars.copy_context().run, primary)}
+    done, pending = wait(pending, timeout=_hedge_delay())
+    if done:
+        result = _future_result(done.pop())
+        return result if result is not None else fallback()
+
+    increment("hedged_fallbacks")
+    pending.add(_executor.submit(contextvars.copy_context().run, fallback))
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            result = _future_result(future)
+            if result is not None:
+                return result
+    return None
+
+def _fmp_profile(ticker):
+    # Ticker original para FMP
+    data = _fmp_get(f"{FMP_BASE_URL}/profile/{ticker}?apikey={FMP_API_KEY}")
+    return data[0] if data else None
+
+def _yahoo_profile(ticker):
     # Fallback com yfinance (com .SA se necessário)
+    increment("network_calls", provider="yahoo")
     try:
         yf_ticker = yf.Ticker(add_sa_suffix_if_needed(ticker))
         info = yf_ticker.info
@@ -36,26 +185,132 @@ def get_company_profile(ticker):
             'dividendYield': info.get('dividendYield', 0),
             'sharesOutstanding': info.get('sharesOutstanding'),
             'bookValuePerShare': info.get('bookValue'),
+            'volAvg': info.get('averageVolume'),
         }
     except Exception as e:
         print(f"[Yahoo] Erro ao buscar profile: {e}")
         return None
 
-def get_financial_statements(ticker, statement_type='income-statement', period='annual'):
+def _live_company_profile(ticker):
+    return _hedged_call(lambda: _fmp_profile(ticker), lambda: _yahoo_profile(ticker))
+
+def _fmp_statements(ticker, statement_type, period, limit):
+    url = f"{FMP_BASE_URL}/{statement_type}/{ticker}?period={period}&apikey={FMP_API_KEY}"
+    if limit:
+        url += f"&limit={int(limit)}"
+    data = _fmp_get(url)
+    return pd.DataFrame(data) if data else None
+
+def _yahoo_statements(ticker, statement_type, period, limit):
+    # Fallback com yfinance: linhas renomeadas para os campos do FMP, um período por linha (mais recente primeiro)
+    increment("network_calls", provider="yahoo")
     try:
-        url = f"https://financialmodelingprep.com/api/v3/{statement_type}/{ticker}?period={period}&apikey={FMP_API_KEY}"
-        response = requests.get(url, timeout=10)
-        if response.status_code == 200 and response.json():
-            return pd.DataFrame(response.json())
+        yf_ticker = yf.Ticker(add_sa_suffix_if_needed(ticker))
+        # Atributo lido sob demanda: cada um dispara o download do respectivo demonstrativo
+        attribute = {
+            'income-statement': 'income_stmt',
+            'balance-sheet-statement': 'balance_sheet',
+            'cash-flow-statement': 'cashflow',
+        }[statement_type]
+        raw = getattr(yf_ticker, f"quarterly_{attribute}" if period == 'quarter' else attribute)
+        if raw is None or raw.empty:
+            return None
+
+        fields = YF_STATEMENT_FIELDS[statement_type]
+        statements = raw.reindex([row for row in fields if row in raw.index]).rename(index=fields).T
+        statements = statements.sort_index(ascending=False)
+        statements.insert(0, 'date', pd.to_datetime(statements.index).strftime('%Y-%m-%d'))
+        statements.insert(1, 'symbol', ticker)
+        statements = statements.reset_index(drop=True)
+        return statements.head(limit) if limit else statements
     except Exception as e:
-        print(f"[FMP] Erro ao buscar {statement_type}: {e}")
-    return pd.DataFrame()
+        print(f"[Yahoo] Erro ao buscar {statement_type}: {e}")
+        return None
 
-def get_historical_prices(ticker, period='1y'):
+def _live_financial_statements(ticker, statement_type, period, limit):
+    statements = _hedged_call(
+        lambda: _fmp_statements(ticker, statement_type, period, limit),
+        lambda: _yahoo_statements(ticker, statement_type, period, limit),
+    )
+    return statements if statements is not None else pd.DataFrame()
+
+def _live_historical_prices(ticker, period):
+    increment("network_calls", provider="yahoo")
     try:
         yf_ticker = add_sa_suffix_if_needed(ticker)
         df = yf.download(yf_ticker, period=period, progress=False)
+        # Versões recentes do yfinance retornam colunas (campo, ticker) mesmo para um único ticker:
+        # achatadas para "Close", "Open"... (formato esperado pelo cache e pelas gravações)
+        if isinstance(df.columns, pd.MultiIndex):
+            df.columns = df.columns.get_level_values(0)
         return df
     except Exception as e:
         print(f"[Yahoo] Erro ao baixar preços históricos: {e}")
         return pd.DataFrame()
+
+# --- Seleção do provedor de dados ---
+
+class LiveProvider(DataProvider):
+    # FMP com fallback hedged para o yfinance (preços sempre via yfinance)
+    name = "live"
+    uses_network = True
+
+    def get_company_profile(self, ticker):
+        return _live_company_profile(ticker)
+
+    def get_financial_statements(self, ticker, statement_type='income-statement', period='annual', limit=None):
+        return _live_financial_statements(ticker, statement_type, period, limit)
+
+    def get_historical_prices(self, ticker, period='1y'):
+        return _live_historical_prices(ticker, period)
+
+def provider_from_spec(spec):
+    # "live", "record:<arquivo.zip>", "replay:<arquivo.zip>" ou "synthetic[:semente]"
+    kind, _, argument = spec.partition(':')
+    if kind == 'live':
+        return LiveProvider()
+    if kind == 'record':
+        return RecordingProvider(LiveProvider(), argument or os.path.join('data', 'recordings', 'fetch.zip'))
+    if kind == 'replay':
+        return ReplayProvider(argument or os.path.join('data', 'recordings', 'fetch.zip'))
+    if kind == 'synthetic':
+        return SyntheticProvider(seed=int(argument or 0))
+    raise ValueError(f"Provedor de dados desconhecido: {spec}")
+
+_provider = None
+
+def get_provider():
+    global _provider
+    if _provider is None:
+        _provider = provider_from_spec(DATA_PROVIDER)
+    return _provider
+
+def set_provider(provider):
+    # Troca o provedor ativo (aceita uma instância de DataProvider ou uma especificação em texto)
+    global _provider
+    if _provider is not None and _provider is not provider:
+        # Fecha o anterior (ex: grava o diretório central de um RecordingProvider)
+        _provider.close()
+    _provider = provider_from_spec(provider) if isinstance(provider, str) else provider
+    return _provider
+
+def _dispatch(method, *args):
+    # Provedores de rede passam pela deduplicação single-flight; os offline são chamados diretamente
+    provider = get_provider()
+    func = getattr(provider, method)
+    if not provider.uses_network:
+        return func(*args)
+    return call_once(f"{method}:{provider.name}", func, *args)
+
+@timed("fetch.profile")
+def get_company_profile(ticker):
+    return _dispatch('get_company_profile', ticker)
+
+@timed("fetch.statements")
+def get_financial_statements(ticker, statement_type='income-statement', period='annual', limit=None):
+    # limit: número máximo de períodos mais recentes (atualizações incrementais pedem só os novos)
+    return _dispatch('get_financial_statements', ticker, statement_type, period, limit)
+
+@timed("fetch.prices")
+def get_historical_prices(ticker, period='1y'):
+    return _dispatch('get_historical_prices', ticker, period)
@@ -0,0 +1,278 @@
+import atexit
+import hashlib
+import io
+import json
+import os
+import threading
+import zipfile
+import zlib
+import numpy as np
+import pandas as pd
+
+# Backends de dados plugáveis para o data_fetcher.
+# - RecordingProvider: repassa as chamadas a outro provedor e grava as respostas em um arquivo .zip
+# - ReplayProvider: serve as respostas gravadas, sem rede e com latência zero
+# - SyntheticProvider: gera perfis, demonstrativos e preços realistas para qualquer número de tickers,
+#   de forma determinística (mesmo ticker + semente = mesmos dados), para testes de desempenho offline
+# O provedor ao vivo (FMP + yfinance) fica em data_fetcher.LiveProvider.
+
+class DataProvider:
+    name = "base"
+    # Provedores que acessam a rede passam pela deduplicação single-flight do data_fetcher
+    uses_network = False
+
+    def get_company_profile(self, ticker):
+        raise NotImplementedError
+
+    def get_financial_statements(self, ticker, statement_type='income-statement', period='annual', limit=None):
+        raise NotImplementedError
+
+    def get_historical_prices(self, ticker, period='1y'):
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+# --- Gravação / reprodução ---
+
+def _archive_entry(method, *args):
+    key = json.dumps([method] + [str(arg).upper() if isinstance(arg, str) else arg for arg in args])
+    return f"{method}/{hashlib.sha1(key.encode('utf-8')).hexdigest()}.json"
+
+def _encode(method, response):
+    if response is None:
+        return None
+    if method == "profile":
+        return response
+    if method == "prices":
+        return json.loads(response.to_json(orient="split", date_format="iso", double_precision=15))
+    return response.to_dict(orient="records")
+
+def _decode(method, payload):
+    if method == "profile":
+        return payload
+    if payload is None:
+        return pd.DataFrame()
+    if method == "prices":
+        prices = pd.read_json(io.StringIO(json.dumps(payload)), orient="split")
+        prices.index = pd.to_datetime(prices.index)
+        # Gravações antigas guardaram colunas (campo, ticker) do yfinance, que voltam como tuplas/listas
+        if len(prices.columns) and all(isinstance(col, (tuple, list)) for col in prices.columns):
+            prices.columns = [col[0] for col in prices.columns]
+        return prices
+    return pd.DataFrame(payload)
+
+class RecordingProvider(DataProvider):
+    # Grava cada resposta de 'inner' em um arquivo .zip (JSON comprimido, uma entrada por chamada).
+    # O arquivo fica aberto durante toda a gravação (reabrir em modo "a" a cada resposta regravaria o
+    # diretório central inteiro: O(N²) em universos grandes); o diretório é gravado em close()/saída
+
+    def __init__(self, inner, archive_path):
+        self.inner = inner
+        self.archive_path = archive_path
+        self.name = f"record:{inner.name}"
+        self.uses_network = inner.uses_network
+        self._lock = threading.Lock()
+        self._recorded = set()
+        self._archive = None
+        if os.path.exists(archive_path):
+            with zipfile.ZipFile(archive_path) as archive:
+                self._recorded = set(archive.namelist())
+        atexit.register(self.close)
+
+    def _record(self, method, args, response):
+        entry = _archive_entry(method, *args)
+        payload = json.dumps(_encode(method, response), separators=(",", ":"), default=str)
+        with self._lock:
+            if entry in self._recorded:
+                return
+            if self._archive is None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.archive_path)), exist_ok=True)
+                self._archive = zipfile.ZipFile(self.archive_path, "a", compression=zipfile.ZIP_DEFLATED)
+            self._archive.writestr(entry, payload)
+            self._recorded.add(entry)
+
+    def close(self):
+        with self._lock:
+            if self._archive is not None:
+                self._archive.close()
+                self._archive = None
+
+    def get_company_profile(self, ticker):
+        response = self.inner.get_company_profile(ticker)
+        self._record("profile", (ticker,), response)
+        return response
+
+    def get_financial_statements(self, ticker, statement_type='income-statement', period='annual', limit=None):
+        response = self.inner.get_financial_statements(ticker, statement_type, period, limit)
+        self._record("statements", (ticker, statement_type, period, limit), response)
+        return response
+
+    def get_historical_prices(self, ticker, period='1y'):
+        response = self.inner.get_historical_prices(ticker, period)
+        self._record("prices", (ticker, period), response)
+        return response
+
+class ReplayProvider(DataProvider):
+    # Serve as respostas de um arquivo gravado pelo RecordingProvider, sem acessar a rede
+
+    def __init__(self, archive_path):
+        self.archive_path = archive_path
+        self.name = f"replay:{os.path.basename(archive_path)}"
+        self._lock = threading.Lock()
+        self._archive = zipfile.ZipFile(archive_path)
+        self._entries = set(self._archive.namelist())
+
+    def close(self):
+        with self._lock:
+            self._archive.close()
+
+    def _replay(self, method, *args):
+        entry = _archive_entry(method, *args)
+        if entry not in self._entries:
+            print(f"[Replay] Resposta não gravada: {method} {args}")
+            return _decode(method, None)
+        with self._lock:
+            payload = json.loads(self._archive.read(entry))
+        return _decode(method, payload)
+
+    def get_company_profile(self, ticker):
+        return self._replay("profile", ticker)
+
+    def get_financial_statements(self, ticker, statement_type='income-statement', period='annual', limit=None):
+        if limit and _archive_entry("statements", ticker, statement_type, period, limit) not in self._entries:
+            # Atualizações incrementais pedem 'limit' períodos: servidos a partir do histórico completo
+            return self._replay("statements", ticker, statement_type, period, None).head(limit)
+        return self._replay("statements", ticker, statement_type, period, limit)
+
+    def get_historical_prices(self, ticker, period='1y'):
+        return self._replay("prices", ticker, period)
+
+# --- Gerador sintético ---
+
+# Dias úteis por janela de preços no formato do yfinance
+PERIOD_DAYS = {"1mo": 21, "3mo": 63, "6mo": 126, "1y": 252, "2y": 504, "5y": 1260, "10y": 2520, "max": 2520}
+
+class SyntheticProvider(DataProvider):
+    # Dados sintéticos e determinísticos por ticker, com ordens de grandeza de empresas listadas na B3
+
+    def __init__(self, seed=0, end_date=None):
+        self.seed = seed
+        self.name = f"synthetic:{seed}"
+        self.end_date = pd.Timestamp(end_date or "2024-12-31").normalize()
+
+    def _rng(self, ticker, salt=""):
+        return np.random.default_rng([self.seed, zlib.crc32(f"{ticker.upper()}|{salt}".encode("utf-8"))])
+
+    def _fundamentals(self, ticker):
+        # Características fixas da empresa (escala, margens, alavancagem, crescimento)
+        rng = self._rng(ticker)
+        shares = float(rng.integers(50, 5000)) * 1e6
+        revenue = shares * rng.uniform(5, 60)
+        return {
+            "shares": shares,
+            "revenue": revenue,
+            "net_margin": rng.uniform(-0.02, 0.25),
+            "ebitda_margin": rng.uniform(0.1, 0.45),
+            "growth": rng.uniform(-0.03, 0.15),
+            "equity_ratio": rng.uniform(0.3, 1.5),
+            "debt_ratio": rng.uniform(0.0, 1.2),
+            "payout": rng.uniform(0.0, 0.9),
+            "pe": rng.uniform(4, 25),
+        }
+
+    def get_company_profile(self, ticker):
+        company = self._fundamentals(ticker)
+        rng = self._rng(ticker, "profile")
+        eps = company["revenue"] * company["net_margin"] / company["shares"]
+        price = max(abs(eps) * company["pe"], 1.0)
+        dividend_yield = max(eps, 0) * company["payout"] / price
+        return {
+            "symbol": ticker.upper(),
+            "companyName": f"{ticker.upper()} S.A. (sintético)",
+            "price": round(price, 2),
+            "dividendYield": dividend_yield,
+            "lastDiv": round(dividend_yield * price, 4),
+            "sharesOutstanding": company["shares"],
+            "bookValuePerShare": company["revenue"] * company["equity_ratio"] / company["shares"],
+            "mktCap": price * company["shares"],
+            "volAvg": float(rng.integers(10_000, 20_000_000)),
+            "beta": rng.uniform(0.4, 1.6),
+            "currency": "BRL",
+        }
+
+    def get_financial_statements(self, ticker, statement_type='income-statement', period='annual', limit=None):
+        company = self._fundamentals(ticker)
+        rng = self._rng(ticker, f"{statement_type}|{period}")
+        quarterly = period == "quarter"
+        num_periods = limit or (40 if quarterly else 10)
+        dates = pd.date_range(end=self.end_date, periods=num_periods, freq="QE" if quarterly else "YE")[::-1]
+
+        # Receita recua no tempo pela taxa de crescimento, com ruído por período
+        scale = 0.25 if quarterly else 1.0
+        years_back = np.arange(num_periods) / (4 if quarterly else 1)
+        revenue = company["revenue"] * scale / (1 + company["growth"]) ** years_back
+        revenue = revenue * rng.normal(1.0, 0.05, num_periods)
+        net_income = revenue * (company["net_margin"] + rng.normal(0, 0.02, num_periods))
+        ebitda = revenue * (company["ebitda_margin"] + rng.normal(0, 0.02, num_periods))
+
+        if statement_type == "income-statement":
+            data = {
+                "revenue": revenue,
+                "grossProfit": revenue * rng.uniform(0.3, 0.6),
+                "grossProfitRatio": np.full(num_periods, 0.45),
+                "operatingIncome": ebitda * 0.8,
+                "ebitda": ebitda,
+                "netIncome": net_income,
+                "eps": net_income / company["shares"],
+                "epsdiluted": net_income / company["shares"],
+                "weightedAverageShsOut": np.full(num_periods, company["shares"]),
+            }
+        elif statement_type == "balance-sheet-statement":
+            equity = company["revenue"] * company["equity_ratio"] / (1 + company["growth"]) ** years_back
+            debt = company["revenue"] * company["debt_ratio"] / (1 + company["growth"]) ** years_back
+            data = {
+                "totalAssets": equity + debt * 1.5,
+                "totalLiabilities": debt * 1.5,
+                "totalEquity": equity,
+                "totalStockholdersEquity": equity,
+                "totalDebt": debt,
+                "cashAndShortTermInvestments": debt * rng.uniform(0.1, 0.6),
+            }
+        elif statement_type == "cash-flow-statement":
+            capex = -revenue * rng.uniform(0.03, 0.12)
+            operating = ebitda * 0.7
+            data = {
+                "operatingCashFlow": operating,
+                "capitalExpenditure": capex,
+                "freeCashFlow": operating + capex,
+                "dividendsPaid": -np.maximum(net_income, 0) * company["payout"],
+            }
+        else:
+            return pd.DataFrame()
+
+        statements = pd.DataFrame(data)
+        statements.insert(0, "date", dates.strftime("%Y-%m-%d"))
+        statements.insert(1, "symbol", ticker.upper())
+        statements.insert(2, "reportedCurrency", "BRL")
+        statements.insert(3, "period", [f"Q{d.quarter}" for d in dates] if quarterly else "FY")
+        return statements
+
+    def get_historical_prices(self, ticker, period='1y'):
+        # Movimento browniano geométrico terminando no preço do perfil, no formato do yf.download
+        rng = self._rng(ticker, "prices")
+        num_days = PERIOD_DAYS.get(period, 252)
+        dates = pd.bdate_range(end=self.end_date, periods=num_days)
+        volatility = rng.uniform(0.15, 0.5) / np.sqrt(252)
+        drift = rng.uniform(-0.1, 0.25) / 252
+        log_returns = rng.normal(drift - volatility ** 2 / 2, volatility, num_days)
+        path = np.exp(np.cumsum(log_returns) - log_returns.sum())
+        close = self.get_company_profile(ticker)["price"] * path
+        spread = np.abs(rng.normal(0, volatility, num_days))
+        return pd.DataFrame({
+            "Open": close * (1 + rng.normal(0, volatility / 2, num_days)),
+            "High": close * (1 + spread),
+            "Low": close * (1 - spread),
+            "Close": close,
+            "Volume": rng.integers(10_000, 5_000_000, num_days),
+        }, index=pd.DatetimeIndex(dates, name="Date"))
@@ -0,0 +1,365 @@
+import contextlib
+import os
+import threading
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+from data_fetcher import get_financial_statements
+from instrumentation import increment
+
+try:
+    import fcntl
+except ImportError:  # Windows: apenas o lock entre threads do processo
+    fcntl = None
+
+# Armazenamento colunar dos demonstrativos financeiros: (ticker, data de fim do período, campo -> float64).
+# Cada tipo de demonstrativo/período vira um arquivo Arrow IPC sem compressão, aberto via memory map:
+# abrir é instantâneo e apenas as colunas/linhas efetivamente lidas são carregadas do disco.
+# As linhas ficam ordenadas por ticker e data decrescente, e um índice ticker -> linha aponta para o
+# período mais recente de cada ativo.
+
+STORE_DIR = os.environ.get("FUNDAMENTALS_STORE_DIR", os.path.join("data", "fundamentals"))
+
+KEY_COLUMNS = ["ticker", "date"]
+
+# Demonstrativos de fluxo (somados nos últimos 4 trimestres para o TTM); o balanço é posição (último trimestre)
+FLOW_STATEMENTS = {"income-statement", "cash-flow-statement"}
+# Trechos de nomes de campos de estoque nos demonstrativos de fluxo (não somados no TTM)
+STOCK_FIELD_MARKERS = ("shsout", "sharesoutstanding", "numberofshares")
+STATEMENT_TYPES = ["income-statement", "balance-sheet-statement", "cash-flow-statement"]
+
+# Histórico trimestral baixado na primeira carga de um ticker
+INITIAL_QUARTERS = 12
+# Um trimestre é considerado "novo" a partir de ~90 dias após o fim do último armazenado
+QUARTER_DAYS = 90
+# Exercício anual novo: ~1 ano após o último armazenado
+YEAR_DAYS = 365
+
+# Campos numéricos do perfil guardados como um "demonstrativo" de fotografias diárias (period='snapshot')
+PROFILE_FIELDS = ["price", "dividendYield", "sharesOutstanding", "bookValuePerShare", "volAvg", "mktCap", "beta"]
+
+# Campos textuais/identificadores do FMP que não entram no armazenamento numérico
+NON_NUMERIC_FIELDS = {
+    "symbol", "reportedCurrency", "cik", "fillingDate", "acceptedDate", "calendarYear",
+    "period", "link", "finalLink",
+}
+
+_lock = threading.Lock()
+# path -> (mtime, pyarrow.Table, {ticker: (primeira_linha, ultima_linha)})
+_open_tables = {}
+# path -> lock de escrita (cada gravação lê o arquivo inteiro e o regrava: escritores são serializados)
+_write_locks = {}
+
+def _table_path(statement_type, period):
+    return os.path.join(STORE_DIR, f"{statement_type}_{period}.arrow")
+
+def normalize_statements(ticker, statements_df):
+    # Converte a resposta do FMP (DataFrame largo de objetos) em linhas tipadas: ticker, date, campos float64
+    if statements_df is None or statements_df.empty or "date" not in statements_df.columns:
+        return pd.DataFrame(columns=KEY_COLUMNS)
+
+    fields = [col for col in statements_df.columns if col not in NON_NUMERIC_FIELDS and col not in KEY_COLUMNS]
+    normalized = statements_df[fields].apply(pd.to_numeric, errors="coerce").astype(np.float64)
+    normalized.insert(0, "date", pd.to_datetime(statements_df["date"], errors="coerce").astype("datetime64[ms]"))
+    normalized.insert(0, "ticker", ticker.upper())
+    return normalized.dropna(subset=["date"])
+
+def _open_table(path):
+    # Abre (ou reaproveita) a tabela via memory map e monta o índice por ticker
+    if not os.path.exists(path):
+        return None, {}
+    mtime = os.path.getmtime(path)
+    with _lock:
+        cached = _open_tables.get(path)
+        if cached and cached[0] == mtime:
+            return cached[1], cached[2]
+
+    table = feather.read_table(path, memory_map=True)
+    tickers = table.column("ticker").to_numpy(zero_copy_only=False)
+    index = {}
+    if len(tickers):
+        # Linhas já ordenadas por ticker: as fronteiras de cada bloco formam o índice
+        boundaries = np.flatnonzero(tickers[1:] != tickers[:-1]) + 1
+        starts = np.concatenate(([0], boundaries))
+        ends = np.concatenate((boundaries, [len(tickers)]))
+        index = {tickers[start]: (int(start), int(end)) for start, end in zip(starts, ends)}
+
+    with _lock:
+        _open_tables[path] = (mtime, table, index)
+    return table, index
+
+@contextlib.contextmanager
+def _write_lock(path):
+    # Serializa as gravações de um arquivo entre threads (sessões do Streamlit, aquecimento em segundo
+    # plano) e entre processos (lock de arquivo ao lado da tabela)
+    with _lock:
+        thread_lock = _write_locks.setdefault(path, threading.Lock())
+    with thread_lock:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(f"{path}.lock", "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def upsert_statements(ticker, statement_type, statements_df, period="annual"):
+    # Insere/atualiza os períodos de um ticker, regravando o arquivo de forma atômica
+    return upsert_statements_bulk(statement_type, {ticker: statements_df}, period=period)
+
+def upsert_statements_bulk(statement_type, statements_by_ticker, period="annual"):
+    # Versão em lote: {ticker: DataFrame} gravados com uma única regravação do arquivo
+    new_rows = [normalize_statements(ticker, df) for ticker, df in statements_by_ticker.items()]
+    new_rows = [rows for rows in new_rows if not rows.empty]
+    if not new_rows:
+        return 0
+    new_rows = pd.concat(new_rows, ignore_index=True)
+
+    path = _table_path(statement_type, period)
+    with _write_lock(path):
+        # Leitura direta do arquivo (não do cache por mtime): inclui o que outro escritor acabou de gravar
+        if os.path.exists(path):
+            combined = pd.concat([feather.read_table(path).to_pandas(), new_rows], ignore_index=True)
+        else:
+            combined = new_rows
+        _write_table(path, combined)
+    return len(new_rows)
+
+def _write_table(path, combined):
+    combined = (
+        combined.drop_duplicates(subset=KEY_COLUMNS, keep="last")
+        .sort_values(["ticker", "date"], ascending=[True, False])
+        .reset_index(drop=True)
+    )
+    field_columns = [col for col in combined.columns if col not in KEY_COLUMNS]
+    combined[field_columns] = combined[field_columns].astype(np.float64)
+
+    # Arquivo temporário próprio de cada escritor; sem compressão, requisito para a leitura zero-copy via memory map
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        feather.write_feather(pa.Table.from_pandas(combined, preserve_index=False), tmp_path,
+                              compression="uncompressed")
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    with _lock:
+        _open_tables.pop(path, None)
+
+def load_statements(statement_type, period="annual", columns=None, tickers=None, latest_only=False):
+    # Lê apenas as colunas pedidas (e, opcionalmente, apenas os tickers/último período pedidos),
+    # retornando um DataFrame indexado por (ticker, date)
+    # Colunas pedidas que não existem no arquivo voltam preenchidas com NaN
+    table, index = _open_table(_table_path(statement_type, period))
+    if table is None:
+        empty = pd.DataFrame(columns=KEY_COLUMNS + list(columns or []), dtype=np.float64)
+        return empty.set_index(KEY_COLUMNS)
+
+    if columns is not None:
+        available = [col for col in columns if col in table.column_names and col not in KEY_COLUMNS]
+        table = table.select(KEY_COLUMNS + available)
+
+    if tickers is not None or latest_only:
+        selected = tickers if tickers is not None else index.keys()
+        rows = []
+        for ticker in selected:
+            bounds = index.get(str(ticker).upper())
+            if bounds:
+                rows.extend([bounds[0]] if latest_only else range(*bounds))
+        table = table.take(pa.array(rows, type=pa.int64()))
+
+    statements = table.to_pandas().set_index(KEY_COLUMNS)
+    if columns is not None:
+        statements = statements.reindex(columns=list(columns))
+    return statements
+
+def _read_row(table, row, fields):
+    values = {}
+    for field in fields:
+        if field in table.column_names:
+            value = table.column(field)[row].as_py()
+            values[field] = None if value is None or np.isnan(value) else value
+        else:
+            values[field] = None
+    return values
+
+def latest_stored_date(ticker, statement_type, period="annual"):
+    table, index = _open_table(_table_path(statement_type, period))
+    bounds = index.get(ticker.upper())
+    if bounds is None:
+        return None
+    return pd.Timestamp(table.column("date")[bounds[0]].as_py())
+
+def get_latest_fields(ticker, statement_type, fields, period="annual", fetch_missing=True):
+    # Campos do período mais recente de um ticker (equivalente a statements.loc[0, fields]).
+    # Se o ticker ainda não estiver no armazenamento, busca no provedor e grava antes de ler
+    # (para muitos tickers, use o aquecimento em lote: refresh_annual/refresh_universe).
+    path = _table_path(statement_type, period)
+    table, index = _open_table(path)
+    bounds = index.get(ticker.upper())
+    increment("cache_misses" if bounds is None else "cache_hits", cache="fundamentals")
+
+    if bounds is None and fetch_missing:
+        statements = get_financial_statements(ticker, statement_type, period=period)
+        if upsert_statements(ticker, statement_type, statements, period=period):
+            table, index = _open_table(path)
+            bounds = index.get(ticker.upper())
+
+    if bounds is None:
+        return None
+
+    return _read_row(table, bounds[0], fields)
+
+def get_most_recent_fields(ticker, statement_type, fields):
+    # Usa o TTM (últimos 4 trimestres) quando ele for mais recente que o último período anual
+    ttm_date = latest_stored_date(ticker, statement_type, period="ttm")
+    annual_date = latest_stored_date(ticker, statement_type, period="annual")
+    if ttm_date is not None and (annual_date is None or ttm_date > annual_date):
+        return get_latest_fields(ticker, statement_type, fields, period="ttm", fetch_missing=False)
+    return get_latest_fields(ticker, statement_type, fields, period="annual")
+
+def load_most_recent(statement_type, columns, tickers=None):
+    # Versão em lote de get_most_recent_fields: último período (TTM ou anual, o mais novo) por ticker
+    frames = [
+        load_statements(statement_type, period=period, columns=columns, tickers=tickers, latest_only=True)
+        for period in ("annual", "ttm")
+    ]
+    frames = [frame.reset_index() for frame in frames if not frame.empty]
+    if not frames:
+        return pd.DataFrame(columns=columns, index=pd.Index([], name="ticker"))
+    combined = pd.concat(frames, ignore_index=True).sort_values("date")
+    latest = combined.drop_duplicates(subset="ticker", keep="last").set_index("ticker")
+    return latest.reindex(columns=columns)
+
+def store_profile(ticker, profile, as_of=None):
+    # Guarda os campos numéricos do perfil (preço, yield, ações, liquidez) para uso sem rede
+    return store_profiles_bulk({ticker: profile}, as_of=as_of)
+
+def store_profiles_bulk(profiles_by_ticker, as_of=None):
+    # Versão em lote de store_profile: {ticker: perfil} gravados com uma única regravação
+    as_of = pd.Timestamp(as_of or pd.Timestamp.today()).normalize()
+    snapshots = {}
+    for ticker, profile in profiles_by_ticker.items():
+        if profile:
+            snapshot = {field: profile.get(field) for field in PROFILE_FIELDS}
+            snapshot["date"] = as_of
+            snapshots[ticker] = pd.DataFrame([snapshot])
+    return upsert_statements_bulk("profile", snapshots, period="snapshot")
+
+def load_profiles(tickers=None, columns=None):
+    # Última fotografia do perfil de cada ticker, indexada por ticker
+    profiles = load_statements("profile", period="snapshot", columns=columns or PROFILE_FIELDS,
+                               tickers=tickers, latest_only=True)
+    return profiles.droplevel("date")
+
+def stored_tickers(statement_type, period="annual"):
+    _, index = _open_table(_table_path(statement_type, period))
+    return list(index.keys())
+
+# --- Atualização incremental trimestral / TTM ---
+
+def _is_stock_field(field):
+    # Campos de posição dentro de demonstrativos de fluxo (ex: weightedAverageShsOut, weightedAverageShsOutDil)
+    field = field.lower()
+    return any(marker in field for marker in STOCK_FIELD_MARKERS)
+
+def _compute_ttm_rows(quarters, new_dates, statement_type):
+    # quarters: trimestres de um ticker indexados por data (decrescente)
+    # Calcula o TTM apenas para as datas novas, a partir dos 4 trimestres terminados em cada uma
+    quarters = quarters.sort_index(ascending=False)
+    rows = []
+    for date in new_dates:
+        window = quarters.loc[quarters.index <= date].head(4)
+        if len(window) < 4 or (window.index[0] - window.index[-1]).days > 300:
+            continue  # trimestres faltando: TTM não confiável
+        if statement_type in FLOW_STATEMENTS:
+            ttm = window.sum(min_count=4)
+            # Margens/índices não são somáveis: recalculados como média dos trimestres
+            ratio_fields = [col for col in window.columns if col.lower().endswith("ratio")]
+            ttm[ratio_fields] = window[ratio_fields].mean()
+            # Quantidades de ações são estoque, não fluxo: vale o último trimestre
+            stock_fields = [col for col in window.columns if _is_stock_field(col)]
+            ttm[stock_fields] = window[stock_fields].iloc[0]
+        else:
+            ttm = window.iloc[0]
+        rows.append(ttm.rename(date))
+    if not rows:
+        return pd.DataFrame()
+    ttm_df = pd.DataFrame(rows)
+    ttm_df.index.name = "date"
+    return ttm_df.reset_index()
+
+def _new_quarters(ticker, statement_type, today):
+    # Trimestres novos de um ticker e os respectivos TTM, ainda sem gravar.
+    # Retorna (requisições feitas, linhas trimestrais novas, linhas TTM novas)
+    last_date = latest_stored_date(ticker, statement_type, period="quarter")
+
+    if last_date is None:
+        limit = INITIAL_QUARTERS
+    else:
+        missing = (today - last_date).days // QUARTER_DAYS
+        if missing < 1:
+            return 0, None, None
+        limit = min(missing, INITIAL_QUARTERS)
+
+    statements = get_financial_statements(ticker, statement_type, period="quarter", limit=limit)
+    new_rows = normalize_statements(ticker, statements)
+    if last_date is not None and not new_rows.empty:
+        new_rows = new_rows[new_rows["date"] > last_date]
+    if new_rows.empty:
+        return 1, None, None
+
+    stored = load_statements(statement_type, period="quarter", tickers=[ticker]).droplevel("ticker")
+    quarters = pd.concat([stored, new_rows.drop(columns="ticker").set_index("date")])
+    quarters = quarters[~quarters.index.duplicated(keep="last")]
+    ttm_rows = _compute_ttm_rows(quarters, pd.DatetimeIndex(new_rows["date"]), statement_type)
+    return 1, new_rows, ttm_rows
+
+def refresh_universe(tickers, statement_types=None, today=None):
+    # Atualização de temporada de balanços: no máximo uma requisição pequena por ticker/demonstrativo,
+    # e uma única regravação por arquivo (trimestral e TTM) para o universo inteiro
+    statement_types = statement_types or STATEMENT_TYPES
+    today = pd.Timestamp(today or pd.Timestamp.today()).normalize()
+    requests_made = 0
+    for statement_type in statement_types:
+        quarters, ttm = {}, {}
+        for ticker in tickers:
+            try:
+                requests, new_rows, ttm_rows = _new_quarters(ticker, statement_type, today)
+            except Exception as e:
+                print(f"[Store] Erro ao atualizar {statement_type} de {ticker}: {e}")
+                continue
+            requests_made += requests
+            if new_rows is not None:
+                quarters[ticker] = new_rows
+                if not ttm_rows.empty:
+                    ttm[ticker] = ttm_rows
+        upsert_statements_bulk(statement_type, quarters, period="quarter")
+        upsert_statements_bulk(statement_type, ttm, period="ttm")
+    return requests_made
+
+def refresh_annual(tickers, statement_types=None, today=None):
+    # Demonstrativos anuais do universo: tickers ausentes recebem o histórico completo; os já armazenados
+    # pedem apenas o exercício mais recente, e só quando o último guardado tem mais de um ano.
+    # Uma única regravação do arquivo anual por demonstrativo
+    statement_types = statement_types or STATEMENT_TYPES
+    today = pd.Timestamp(today or pd.Timestamp.today()).normalize()
+    requests_made = 0
+    for statement_type in statement_types:
+        statements = {}
+        for ticker in dict.fromkeys(tickers):
+            last_date = latest_stored_date(ticker, statement_type)
+            if last_date is not None and (today - last_date).days < YEAR_DAYS:
+                continue
+            limit = None if last_date is None else 1
+            try:
+                statements[ticker] = get_financial_statements(ticker, statement_type, period="annual", limit=limit)
+            except Exception as e:
+                print(f"[Store] Erro ao atualizar {statement_type} anual de {ticker}: {e}")
+                continue
+            requests_made += 1
+        upsert_statements_bulk(statement_type, statements)
+    return requests_made
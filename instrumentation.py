@@ -0,0 +1,154 @@
+import contextlib
+import contextvars
+import cProfile
+import io
+import json
+import pstats
+import threading
+import time
+import tracemalloc
+
+# Instrumentação leve: tempo por etapa, contadores (chamadas de rede, acertos/falhas de cache,
+# iterações dos otimizadores) e captura opcional de cProfile/tracemalloc de uma execução.
+# As métricas globais são do processo (todas as sessões e o aquecimento em segundo plano); uma coleta
+# (start_collection) registra à parte apenas o que roda no próprio contexto, ex: um rerun do app.
+
+METRIC_PREFIX = "sugestaoaporte"
+
+_lock = threading.Lock()
+# etapa -> [chamadas, segundos totais, maior duração]
+_stages = {}
+# (nome, (("rótulo", "valor"), ...)) -> valor
+_counters = {}
+# Coleta ativa no contexto atual: (etapas, contadores) no mesmo formato de _stages/_counters
+_collection = contextvars.ContextVar("metrics_collection", default=None)
+
+def _add_stage(stages, stage, seconds):
+    stats = stages.setdefault(stage, [0, 0.0, 0.0])
+    stats[0] += 1
+    stats[1] += seconds
+    stats[2] = max(stats[2], seconds)
+
+def record_stage(stage, seconds):
+    collection = _collection.get()
+    with _lock:
+        _add_stage(_stages, stage, seconds)
+        if collection is not None:
+            _add_stage(collection[0], stage, seconds)
+
+class timed(contextlib.ContextDecorator):
+    # Uso: "with timed('fetch.profile'):" ou "@timed('valuation.dcf')"
+
+    def __init__(self, stage):
+        self.stage = stage
+        self._started = threading.local()
+
+    def __enter__(self):
+        self._started.value = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record_stage(self.stage, time.perf_counter() - self._started.value)
+        return False
+
+def start_stage(stage):
+    # Para etapas que não cabem em um bloco "with": retorna a função que encerra a medição
+    started = time.perf_counter()
+    return lambda: record_stage(stage, time.perf_counter() - started)
+
+def increment(name, value=1, **labels):
+    key = (name, tuple(sorted((label, str(label_value)) for label, label_value in labels.items())))
+    collection = _collection.get()
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+        if collection is not None:
+            collection[1][key] = collection[1].get(key, 0) + value
+
+def reset():
+    with _lock:
+        _stages.clear()
+        _counters.clear()
+
+def _metrics(stages, counters):
+    return {
+        "stages": {stage: {"calls": calls, "seconds": total, "max_seconds": longest}
+                   for stage, (calls, total, longest) in stages.items()},
+        "counters": {_format_counter(name, labels): value for (name, labels), value in counters.items()},
+    }
+
+def snapshot():
+    # Métricas acumuladas do processo inteiro
+    with _lock:
+        return _metrics(_stages, _counters)
+
+def start_collection():
+    # Passa a coletar as métricas registradas neste contexto (a thread do rerun e as tarefas submetidas
+    # com contextvars.copy_context); retorna a função que encerra a coleta e devolve as métricas
+    collection = ({}, {})
+    token = _collection.set(collection)
+
+    def stop():
+        _collection.reset(token)
+        with _lock:
+            return _metrics(*collection)
+    return stop
+
+def _format_counter(name, labels):
+    if not labels:
+        return name
+    return name + "{" + ",".join(f'{label}="{value}"' for label, value in labels) + "}"
+
+def to_json(metrics=None):
+    return json.dumps(metrics or snapshot(), indent=2, ensure_ascii=False)
+
+def to_prometheus(metrics=None):
+    # Formato de exposição de texto do Prometheus
+    metrics = metrics or snapshot()
+    lines = [
+        f"# TYPE {METRIC_PREFIX}_stage_calls_total counter",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds_total counter",
+        f"# TYPE {METRIC_PREFIX}_stage_seconds_max gauge",
+    ]
+    for stage, stats in sorted(metrics["stages"].items()):
+        label = f'{{stage="{stage}"}}'
+        lines.append(f"{METRIC_PREFIX}_stage_calls_total{label} {stats['calls']}")
+        lines.append(f"{METRIC_PREFIX}_stage_seconds_total{label} {stats['seconds']:.6f}")
+        lines.append(f"{METRIC_PREFIX}_stage_seconds_max{label} {stats['max_seconds']:.6f}")
+
+    declared = set()
+    for counter, value in sorted(metrics["counters"].items()):
+        name, _, labels = counter.partition("{")
+        metric = f"{METRIC_PREFIX}_{name}_total"
+        if metric not in declared:
+            lines.append(f"# TYPE {metric} counter")
+            declared.add(metric)
+        lines.append(f"{metric}{'{' + labels if labels else ''} {value}")
+    return "\n".join(lines) + "\n"
+
+# --- Captura de perfil de uma execução ---
+
+def start_profile():
+    # Inicia cProfile + tracemalloc; a função retornada encerra a captura e devolve o relatório
+    profiler = cProfile.Profile()
+    tracing_already = tracemalloc.is_tracing()
+    if not tracing_already:
+        tracemalloc.start()
+    profiler.enable()
+
+    def stop(top=30):
+        profiler.disable()
+        memory_snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if not tracing_already:
+            tracemalloc.stop()
+
+        stats_stream = io.StringIO()
+        pstats.Stats(profiler, stream=stats_stream).sort_stats("cumulative").print_stats(top)
+        allocations = [str(stat) for stat in memory_snapshot.statistics("lineno")[:top]]
+        return {
+            "cprofile": stats_stream.getvalue(),
+            "tracemalloc_top": allocations,
+            "memory_current_mb": current / 2 ** 20,
+            "memory_peak_mb": peak / 2 ** 20,
+        }
+    return stop
@@ -0,0 +1,113 @@
+import numpy as np
+import pandas as pd
+from instrumentation import timed
+from portfolio_optimizer import (
+    MACRO_SCENARIOS, calculate_current_allocation, hrp_optimization, markowitz_optimization,
+    risk_parity_optimization
+)
+from ticker_registry import classify_tickers
+
+# Motor de cenários macroeconômicos vetorizado.
+# C: matriz classes x cenários (cenários base, misturas ponderadas por probabilidade e cenários do usuário)
+# W: matriz ativos x classes com os pesos de cada ativo dentro da sua classe (vindos dos otimizadores)
+# Pesos-alvo por ativo de todos os cenários de uma vez: T = W @ C (ativos x cenários), pronto para
+# suggest_rebalance / suggest_new_contribution_allocation e para comparar cenários.
+
+# Classes do cadastro que entram em outra classe dos cenários; classes sem linha na matriz (ex: "Outros")
+# ficam com peso zero
+SCENARIO_CLASS_GROUPS = {
+    "Ações (Units)": "Ações",
+    "ETF": "Ações",
+    "ETF (Exterior)": "Exterior",
+    "ETF (Renda Fixa)": "Renda Fixa",
+}
+
+# Otimizadores disponíveis para os pesos dentro de cada classe
+WITHIN_CLASS_OPTIMIZERS = {
+    "Markowitz (Mínima Variância)": markowitz_optimization,
+    "HRP (Hierarchical Risk Parity)": hrp_optimization,
+    "Risk Parity": risk_parity_optimization,
+}
+
+def scenario_matrix(blends=None, custom=None, base=MACRO_SCENARIOS):
+    # blends: {nome: {cenário: probabilidade}} - misturas ponderadas de cenários (base ou personalizados)
+    # custom: {nome: {classe: peso}} - cenários definidos pelo usuário
+    # Retorna a matriz classes x cenários com cada coluna somando 1
+    matrix = base.copy()
+    if custom:
+        matrix = pd.concat([matrix, pd.DataFrame(custom)], axis=1).fillna(0.0)
+    if blends:
+        # Probabilidades (cenários x misturas) normalizadas: todas as misturas em um único produto de matrizes
+        probabilities = pd.DataFrame(blends).reindex(matrix.columns).fillna(0.0)
+        probabilities = probabilities / probabilities.sum().replace(0, np.nan)
+        matrix = pd.concat([matrix, matrix @ probabilities.fillna(0.0)], axis=1)
+    totals = matrix.sum().replace(0, np.nan)
+    return (matrix / totals).fillna(0.0).rename_axis("Classe")
+
+def scenario_classes(asset_classes):
+    # Classe do cadastro -> classe usada nos cenários
+    return pd.Series(asset_classes).replace(SCENARIO_CLASS_GROUPS)
+
+@timed("scenarios.within_class")
+def within_class_weights(returns_df, asset_classes, optimizer=markowitz_optimization):
+    # returns_df: retornos dos ativos (colunas); asset_classes: classe de cada coluna, na mesma ordem
+    # Retorna W (ativos x classes): cada coluna soma 1 sobre os ativos da classe. O otimizador roda
+    # uma vez por classe, independente de quantos cenários serão avaliados
+    classes = scenario_classes(asset_classes).to_numpy()
+    assets = returns_df.columns
+    weights = pd.DataFrame(0.0, index=assets, columns=list(dict.fromkeys(classes)))
+    for asset_class in weights.columns:
+        members = assets[classes == asset_class]
+        if len(members) == 1:
+            weights.loc[members, asset_class] = 1.0
+            continue
+        class_weights = optimizer(returns_df[members]).reindex(members).fillna(0.0)
+        total = class_weights.sum()
+        weights.loc[members, asset_class] = class_weights.to_numpy() / total if total > 0 else 1 / len(members)
+    return weights.rename_axis("Ativo")
+
+def scenario_asset_weights(class_matrix, class_weights):
+    # Pesos-alvo por ativo para todos os cenários: T = W @ C, com C restrita às classes presentes na
+    # carteira e renormalizada sobre elas (classes ausentes não deixam caixa sobrando)
+    present = class_matrix.reindex(class_weights.columns).fillna(0.0)
+    totals = present.sum().replace(0, np.nan)
+    present = (present / totals).fillna(0.0)
+    targets = class_weights.to_numpy() @ present.to_numpy()
+    return pd.DataFrame(targets, index=class_weights.index, columns=class_matrix.columns)
+
+def scenario_targets(returns_df, asset_classes, blends=None, custom=None, optimizer=markowitz_optimization):
+    # Tabela completa ativos x cenários em uma passada
+    class_weights = within_class_weights(returns_df, asset_classes, optimizer)
+    return scenario_asset_weights(scenario_matrix(blends, custom), class_weights)
+
+def compare_scenarios(current_portfolio_df, targets):
+    # Comparação entre cenários a partir da carteira atual: giro necessário (fração da carteira a
+    # negociar) e maior desvio por ativo, todos os cenários de uma vez
+    portfolio_df = current_portfolio_df
+    if "AlocacaoAtual" not in portfolio_df.columns:
+        portfolio_df = calculate_current_allocation(portfolio_df.copy())
+    current = portfolio_df.groupby("Ativo")["AlocacaoAtual"].sum().reindex(targets.index).fillna(0.0)
+    differences = targets.sub(current, axis=0)
+    return pd.DataFrame({
+        "Giro Necessário": differences.abs().sum() / 2,
+        "Maior Desvio": differences.abs().max(),
+    }).rename_axis("Cenário")
+
+# Exemplo de uso (para testes)
+if __name__ == '__main__':
+    assets = ['ITUB3', 'WEGE3', 'MXRF11', 'IVV', 'LFT']
+    returns_df = pd.DataFrame(np.random.normal(0.001, 0.02, (252, len(assets))), columns=assets)
+    classes = classify_tickers(assets)
+
+    targets = scenario_targets(
+        returns_df, classes,
+        blends={'ponderado': {'expansionista': 0.25, 'neutro': 0.5, 'restritivo': 0.25}},
+        custom={'personalizado': {'Ações': 0.5, 'FII': 0.3, 'Renda Fixa': 0.2}},
+    )
+    print("\n--- Pesos-alvo por Ativo e Cenário ---")
+    print(targets.round(4))
+
+    portfolio_df = pd.DataFrame({'Ativo': assets, 'Quantidade': [100, 50, 200, 10, 1],
+                                 'PrecoUnitario': [25.0, 35.0, 10.0, 400.0, 10000.0]})
+    print("\n--- Comparação de Cenários ---")
+    print(compare_scenarios(portfolio_df, targets).round(4))
@@ -0,0 +1,280 @@
+import hashlib
+import os
+import numpy as np
+import pandas as pd
+from cache_warmer import CACHE_DIR, load_cached_covariance, load_cached_returns
+from fundamentals_store import STORE_DIR
+from instrumentation import increment, timed
+from macro_scenarios import (
+    WITHIN_CLASS_OPTIMIZERS, compare_scenarios, scenario_asset_weights, scenario_matrix, within_class_weights
+)
+from portfolio_optimizer import (
+    calculate_current_allocation, hrp_optimization, markowitz_optimization, risk_parity_optimization,
+    suggest_new_contribution_allocation, suggest_rebalance
+)
+from ticker_registry import classify_tickers, normalize_tickers
+from valuation import (
+    bazin_values, calculate_opportunity_scores, dcf_values, ddm_values, get_buy_signals, graham_values,
+    liquidity_values, load_valuation_inputs, patrimonial_values
+)
+
+# Grafo de recomputação incremental do app:
+# carteira -> classificação/alocação -> fundamentos -> valuation -> retornos/covariância -> otimização
+# -> rebalanceamento/aporte.
+# Cada etapa é memorizada pelas suas próprias entradas (valores de parâmetros e impressões digitais dos
+# resultados das etapas anteriores). Se uma etapa é recalculada mas produz o mesmo resultado, as
+# seguintes continuam valendo. O cache é um dicionário comum (no app, guardado em st.session_state).
+
+def fingerprint(value):
+    # Impressão digital estável de um valor (DataFrames/arrays pelo conteúdo, demais pelo repr)
+    digest = hashlib.sha1()
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+        digest.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode("utf-8"))
+    elif isinstance(value, np.ndarray):
+        digest.update(repr((value.dtype.str, value.shape)).encode("utf-8"))
+        digest.update(np.ascontiguousarray(value).tobytes())
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            digest.update(fingerprint(item).encode("utf-8"))
+    elif isinstance(value, dict):
+        for key in sorted(value, key=repr):
+            digest.update(repr(key).encode("utf-8"))
+            digest.update(fingerprint(value[key]).encode("utf-8"))
+    else:
+        digest.update(repr(value).encode("utf-8"))
+    return digest.hexdigest()
+
+def data_version(*directories):
+    # Versão dos dados em disco (maior mtime dos arquivos): muda quando o aquecimento de cache grava algo
+    latest = 0.0
+    for directory in directories:
+        if os.path.isdir(directory):
+            for entry in os.scandir(directory):
+                latest = max(latest, entry.stat().st_mtime)
+    return latest
+
+class Pipeline:
+
+    def __init__(self, cache=None):
+        # cache: nome da etapa -> (chave das entradas, resultado, impressão digital do resultado)
+        self.cache = {} if cache is None else cache
+        self._stages = {}
+        self._switches = {}
+        self._inputs = {}
+        self._resolved = {}
+        self.recomputed = []
+
+    def add(self, name, func, inputs=(), warm_start=False):
+        # inputs: nomes de entradas externas (set_inputs) ou de outras etapas, passados a func por nome.
+        # warm_start: func recebe também 'previous', o último resultado calculado (ex: ponto de partida do otimizador)
+        self._stages[name] = (func, tuple(inputs), warm_start)
+
+    def switch(self, name, selector, branches, default):
+        # Etapa que repassa o resultado de um dos ramos conforme o valor da entrada 'selector'
+        # (branches: valor -> etapa); apenas o ramo escolhido é calculado
+        self._switches[name] = (selector, dict(branches), default)
+
+    def set_inputs(self, **values):
+        for name, value in values.items():
+            self._inputs[name] = (value, fingerprint(value))
+        # Resolução vale para um conjunto de entradas; entradas novas exigem revalidar as etapas
+        self._resolved.clear()
+
+    def _resolve(self, name):
+        if name in self._inputs:
+            return self._inputs[name]
+        if name in self._switches:
+            selector, branches, default = self._switches[name]
+            return self._resolve(branches.get(self._resolve(selector)[0], default))
+        if name not in self._stages:
+            raise KeyError(f"Etapa ou entrada desconhecida: {name}")
+        if name in self._resolved:
+            return self._resolved[name]
+
+        func, inputs, warm_start = self._stages[name]
+        resolved = {input_name: self._resolve(input_name) for input_name in inputs}
+        key = fingerprint([name] + [resolved[input_name][1] for input_name in inputs])
+
+        cached = self.cache.get(name)
+        if cached is not None and cached[0] == key:
+            increment("pipeline_stages", stage=name, result="cache")
+            result = (cached[1], cached[2])
+        else:
+            increment("pipeline_stages", stage=name, result="recomputed")
+            kwargs = {input_name: value for input_name, (value, _) in resolved.items()}
+            if warm_start:
+                kwargs["previous"] = cached[1] if cached is not None else None
+            with timed(f"pipeline.{name}"):
+                value = func(**kwargs)
+            result = (value, fingerprint(value))
+            self.cache[name] = (key, result[0], result[1])
+            self.recomputed.append(name)
+
+        self._resolved[name] = result
+        return result
+
+    def get(self, name):
+        return self._resolve(name)[0]
+
+# --- Etapas do app ---
+
+def _assets(portfolio):
+    return portfolio["Ativo"].astype(str).tolist()
+
+def _store_keys(assets):
+    return normalize_tickers(pd.Series(assets, dtype=object)).tolist()
+
+def _allocation(portfolio):
+    allocation = portfolio.copy()
+    allocation["Classe"] = classify_tickers(allocation["Ativo"])
+    return calculate_current_allocation(allocation)
+
+def _fundamentals(store_keys, fundamentals_version):
+    return load_valuation_inputs(store_keys)
+
+def _valuation(assets, store_keys, portfolio, fundamentals, dcf, graham, bazin, ddm, patrimonial, liquidity):
+    valuation_df = pd.DataFrame({
+        "Preço Atual": fundamentals["price"],
+        "DCF": dcf,
+        "Graham": graham,
+        "Bazin": bazin,
+        "DDM": ddm,
+        "Valor Patrimonial": patrimonial,
+        "Liquidez": liquidity,
+    }).astype(float).reindex(store_keys)
+    valuation_df.index = pd.Index(assets, name="Ativo")
+    # Sem preço em cache, vale o preço informado na carteira
+    valuation_df["Preço Atual"] = valuation_df["Preço Atual"].fillna(
+        pd.Series(portfolio["PrecoUnitario"].to_numpy(dtype=float), index=valuation_df.index))
+    return valuation_df
+
+def _opportunity(valuation, reference_method):
+    opportunity_df = valuation.copy()
+    opportunity_df["Score Oportunidade (%)"] = calculate_opportunity_scores(
+        opportunity_df["Preço Atual"], opportunity_df[reference_method])
+    opportunity_df["Sinal"] = get_buy_signals(opportunity_df["Preço Atual"], opportunity_df[reference_method])
+    return opportunity_df
+
+def _returns(assets, store_keys, prices_version):
+    # (retornos, vindos_do_cache): renda fixa/outros entram como caixa; se algum ativo de mercado não tem
+    # preços no cache, retornos fictícios para demonstração (semente fixa, para que a etapa seja determinística)
+    returns_df = load_cached_returns(store_keys)
+    if returns_df is not None and len(returns_df.columns) == len(store_keys):
+        returns_df.columns = assets
+        return returns_df, True
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(rng.normal(0.001, 0.02, (252, len(assets))), columns=assets), False
+
+def _asset_classes(assets):
+    return classify_tickers(pd.Series(assets, dtype=object)).tolist()
+
+def _equal_weights(returns_df):
+    return pd.Series(1 / len(returns_df.columns), index=returns_df.columns)
+
+def _within_class_weights(returns, asset_classes, class_optimization_method):
+    # Sem preços no cache, pesos iguais dentro de cada classe (a alocação por classe dos cenários segue valendo)
+    returns_df, from_cache = returns
+    optimizer = WITHIN_CLASS_OPTIMIZERS[class_optimization_method] if from_cache else _equal_weights
+    return within_class_weights(returns_df, asset_classes, optimizer)
+
+def _scenario_matrix(scenario_probabilities, custom_scenario):
+    # Cenários base + cenário personalizado (opcional) + mistura ponderada pelas probabilidades
+    custom = {"personalizado": custom_scenario} if custom_scenario else None
+    return scenario_matrix(blends={"ponderado": scenario_probabilities}, custom=custom)
+
+def _macro_weights(scenario_targets, macro_scenario):
+    return scenario_targets[macro_scenario]
+
+def _covariance(returns, store_keys):
+    # Covariância anualizada: a pré-calculada pelo aquecimento quando os retornos vêm do cache
+    returns_df, from_cache = returns
+    covariance = load_cached_covariance(store_keys) if from_cache else None
+    if covariance is None:
+        return returns_df.cov() * 252
+    covariance.index = covariance.columns = returns_df.columns
+    return covariance
+
+def _optimization(returns, covariance, optimization_method, max_weight, previous):
+    returns_df = returns[0]
+    if optimization_method == "Markowitz (Mínima Variância)":
+        return markowitz_optimization(returns_df, max_weight=max_weight, initial_weights=previous,
+                                      cov_matrix=covariance)
+    if optimization_method == "HRP (Hierarchical Risk Parity)":
+        return hrp_optimization(returns_df)
+    return risk_parity_optimization(returns_df)
+
+def _scores(opportunity):
+    return opportunity["Score Oportunidade (%)"]
+
+def _target_weights(optimization, returns, optimization_method):
+    # Pesos usados nas sugestões: os otimizadores quantitativos só valem com retornos reais; sem preços no
+    # cache, pesos iguais (retornos fictícios não devem gerar compras e vendas)
+    if returns[1] or optimization_method == "Heurística Macroeconômica":
+        return optimization
+    return pd.Series(1 / len(optimization), index=optimization.index)
+
+def _rebalance(allocation, target_weights, allow_sales):
+    return suggest_rebalance(allocation, target_weights, allow_sales)
+
+def _contribution(allocation, target_weights, new_contribution, scores):
+    return suggest_new_contribution_allocation(allocation, target_weights, new_contribution, scores.to_dict())
+
+def build_portfolio_pipeline(cache=None):
+    # Entradas esperadas em set_inputs: portfolio, fundamentals_version, prices_version, dcf_growth_rate,
+    # dcf_discount_rate, bazin_min_yield, risk_free_rate, reference_method, optimization_method,
+    # max_weight, allow_sales, new_contribution e, na heurística macroeconômica, macro_scenario,
+    # scenario_probabilities, custom_scenario e class_optimization_method
+    pipeline = Pipeline(cache)
+    pipeline.add("assets", _assets, ["portfolio"])
+    pipeline.add("store_keys", _store_keys, ["assets"])
+    pipeline.add("allocation", _allocation, ["portfolio"])
+    pipeline.add("fundamentals", _fundamentals, ["store_keys", "fundamentals_version"])
+
+    # Uma etapa por método: mudar o yield de Bazin recalcula apenas a coluna de Bazin
+    pipeline.add("dcf", lambda fundamentals, dcf_growth_rate, dcf_discount_rate: dcf_values(
+        fundamentals, growth_rate=dcf_growth_rate, discount_rate=dcf_discount_rate),
+        ["fundamentals", "dcf_growth_rate", "dcf_discount_rate"])
+    pipeline.add("graham", lambda fundamentals, risk_free_rate: graham_values(
+        fundamentals, aaa_bond_yield=risk_free_rate), ["fundamentals", "risk_free_rate"])
+    pipeline.add("bazin", lambda fundamentals, bazin_min_yield: bazin_values(
+        fundamentals, min_desired_yield=bazin_min_yield), ["fundamentals", "bazin_min_yield"])
+    pipeline.add("ddm", lambda fundamentals: ddm_values(fundamentals), ["fundamentals"])
+    pipeline.add("patrimonial", lambda fundamentals: patrimonial_values(fundamentals), ["fundamentals"])
+    pipeline.add("liquidity", lambda fundamentals: liquidity_values(fundamentals), ["fundamentals"])
+    pipeline.add("valuation", _valuation, ["assets", "store_keys", "portfolio", "fundamentals", "dcf", "graham",
+                                           "bazin", "ddm", "patrimonial", "liquidity"])
+    pipeline.add("opportunity", _opportunity, ["valuation", "reference_method"])
+    # Apenas o score segue adiante: mudar um método que não é o de referência não refaz o aporte
+    pipeline.add("scores", _scores, ["opportunity"])
+
+    pipeline.add("returns", _returns, ["assets", "store_keys", "prices_version"])
+    pipeline.add("covariance", _covariance, ["returns", "store_keys"])
+    # Mudar o peso máximo resolve de novo apenas o otimizador, partindo da solução anterior
+    pipeline.add("optimizer_weights", _optimization,
+                 ["returns", "covariance", "optimization_method", "max_weight"], warm_start=True)
+
+    # Heurística macroeconômica: pesos-alvo de todos os cenários em uma passada (T = W @ C); trocar o
+    # cenário escolhido apenas seleciona outra coluna da tabela
+    pipeline.add("asset_classes", _asset_classes, ["assets"])
+    pipeline.add("within_class_weights", _within_class_weights,
+                 ["returns", "asset_classes", "class_optimization_method"])
+    pipeline.add("scenario_matrix", _scenario_matrix, ["scenario_probabilities", "custom_scenario"])
+    pipeline.add("scenario_targets", lambda scenario_matrix, within_class_weights: scenario_asset_weights(
+        scenario_matrix, within_class_weights), ["scenario_matrix", "within_class_weights"])
+    pipeline.add("scenario_comparison", lambda allocation, scenario_targets: compare_scenarios(
+        allocation, scenario_targets), ["allocation", "scenario_targets"])
+    pipeline.add("macro_weights", _macro_weights, ["scenario_targets", "macro_scenario"])
+
+    # Pesos ideais usados no rebalanceamento e no aporte, conforme o método escolhido
+    pipeline.switch("optimization", "optimization_method", {"Heurística Macroeconômica": "macro_weights"},
+                    default="optimizer_weights")
+
+    pipeline.add("target_weights", _target_weights, ["optimization", "returns", "optimization_method"])
+    pipeline.add("rebalance", _rebalance, ["allocation", "target_weights", "allow_sales"])
+    pipeline.add("contribution", _contribution, ["allocation", "target_weights", "new_contribution", "scores"])
+    return pipeline
+
+def default_data_versions():
+    # Versões dos fundamentos e dos preços em cache, para as entradas fundamentals_version/prices_version
+    return {"fundamentals_version": data_version(STORE_DIR), "prices_version": data_version(CACHE_DIR)}
@@ -1,21 +1,12 @@
 import pandas as pd
 import numpy as np
 from scipy.optimize import minimize
+from instrumentation import increment, timed
+from ticker_registry import classify_tickers, lookup_ticker
 
 def identify_asset_class(ticker):
-    ticker = ticker.upper()
-    if any(char.isdigit() for char in ticker) and len(ticker) == 5 and ticker.endswith("F11"):
-        return "FII"
-    elif any(char.isdigit() for char in ticker) and len(ticker) == 5 and ticker.endswith("3"):
-        return "Ações"
-    elif any(char.isdigit() for char in ticker) and len(ticker) == 6 and ticker.endswith("11"):
-        return "Ações (Units)"
-    elif ticker in ["LCA", "LFT", "LTN", "DEBENTURES"]:
-        return "Renda Fixa"
-    elif ticker in ["IVV", "QQQM", "QUAL", "XLRE"]:
-        return "Exterior"
-    else:
-        return "Outros"
+    # Para colunas inteiras use classify_tickers (lookup vetorizado no cadastro central)
+    return lookup_ticker(ticker)["Classe"]
 
 def calculate_current_allocation(portfolio_df):
     # portfolio_df deve ter colunas: 'Ativo', 'Quantidade', 'PrecoUnitario'
@@ -37,11 +28,16 @@ def portfolio_volatility(weights, cov_matrix):
 def portfolio_return(weights, returns):
     return np.sum(weights * returns)
 
-def markowitz_optimization(returns_df):
+@timed("optimizer.markowitz")
+def markowitz_optimization(returns_df, max_weight=1.0, initial_weights=None, cov_matrix=None):
     # returns_df: DataFrame com retornos diários/mensais dos ativos
+    # max_weight: peso máximo por ativo (elevado a 1/N quando inviável)
+    # initial_weights: ponto de partida do SLSQP (ex: solução anterior, para recalcular mais rápido)
+    # cov_matrix: covariância já calculada (evita recalcular a partir dos retornos)
     num_assets = len(returns_df.columns)
-    returns = returns_df.mean()
-    cov_matrix = returns_df.cov()
+    if cov_matrix is None:
+        cov_matrix = returns_df.cov()
+    cov_matrix = np.asarray(cov_matrix, dtype=float)
 
     # Função objetivo para minimizar a volatilidade
     def minimize_volatility(weights):
@@ -49,63 +45,60 @@ def markowitz_optimization(returns_df):
 
     # Restrições: soma dos pesos = 1, pesos >= 0
     constraints = ({"type": "eq", "fun": lambda x: np.sum(x) - 1})
-    bounds = tuple((0, 1) for _ in range(num_assets))
-    initial_weights = num_assets * [1. / num_assets,]
+    max_weight = min(max(max_weight, 1. / num_assets), 1.)
+    bounds = tuple((0, max_weight) for _ in range(num_assets))
+    if initial_weights is not None:
+        # Pesos anteriores realinhados aos ativos atuais (ativos novos entram com 1/N) e ajustados aos limites
+        initial_weights = pd.Series(initial_weights, dtype=float).reindex(returns_df.columns).fillna(1. / num_assets)
+        initial_weights = np.clip(initial_weights.to_numpy(), 0, max_weight)
+        initial_weights = initial_weights / initial_weights.sum() if initial_weights.sum() > 0 else None
+    if initial_weights is None:
+        initial_weights = np.full(num_assets, 1. / num_assets)
 
     # Otimização para carteira de mínima variância
     optimal_weights_min_vol = minimize(minimize_volatility, initial_weights, method="SLSQP", bounds=bounds, constraints=constraints)
+    increment("optimizer_iterations", optimal_weights_min_vol.nit, method="markowitz")
+    increment("optimizer_function_evaluations", optimal_weights_min_vol.nfev, method="markowitz")
     
     # Retorna os pesos ótimos
     return pd.Series(optimal_weights_min_vol.x, index=returns_df.columns)
 
 # Placeholder para HRP e Risk Parity
+@timed("optimizer.hrp")
 def hrp_optimization(returns_df):
     # Implementação HRP (Hierarchical Risk Parity) aqui
     # Isso é complexo e requer clustering e cálculo de correlação
     print("HRP Optimization: Placeholder")
     return pd.Series(1/len(returns_df.columns), index=returns_df.columns) # Retorno pesos iguais por enquanto
 
+@timed("optimizer.risk_parity")
 def risk_parity_optimization(returns_df):
     # Implementação Risk Parity aqui
     # Isso envolve igualar a contribuição de risco de cada ativo
     print("Risk Parity Optimization: Placeholder")
     return pd.Series(1/len(returns_df.columns), index=returns_df.columns) # Retorno pesos iguais por enquanto
 
+# Alocação por classe de ativo em cada cenário macroeconômico (classes x cenários).
+# Esta é uma heurística simplificada. Em um modelo real, seria muito mais complexa.
+# Cenários ponderados, personalizados e os pesos por ativo ficam em macro_scenarios.
+MACRO_SCENARIOS = pd.DataFrame({
+    'expansionista': {'Ações': 0.60, 'FII': 0.20, 'Exterior': 0.15, 'Renda Fixa': 0.05},
+    'neutro': {'Ações': 0.40, 'FII': 0.25, 'Exterior': 0.20, 'Renda Fixa': 0.15},
+    'restritivo': {'Ações': 0.20, 'FII': 0.15, 'Exterior': 0.25, 'Renda Fixa': 0.40},
+})
+
 def macroeconomic_heuristic(portfolio_assets, scenario='neutro'):
     # portfolio_assets: lista de tickers ou DataFrame com ativos
     # scenario: 'expansionista', 'neutro', 'restritivo'
-    
-    # Esta é uma heurística simplificada. Em um modelo real, seria muito mais complexa.
-    # Mapeamento de setores/classes para cenários
-    sector_allocation = {
-        'expansionista': {
-            'Ações': 0.60,
-            'FII': 0.20,
-            'Exterior': 0.15,
-            'Renda Fixa': 0.05
-        },
-        'neutro': {
-            'Ações': 0.40,
-            'FII': 0.25,
-            'Exterior': 0.20,
-            'Renda Fixa': 0.15
-        },
-        'restritivo': {
-            'Ações': 0.20,
-            'FII': 0.15,
-            'Exterior': 0.25,
-            'Renda Fixa': 0.40
-        }
-    }
-    
-    if scenario not in sector_allocation:
+    if scenario not in MACRO_SCENARIOS.columns:
         scenario = 'neutro'
         
-    # Retorna uma alocação ideal baseada no cenário macroeconômico
-    # Isso precisaria ser refinado para alocar dentro de cada classe de ativo
-    return sector_allocation[scenario]
+    # Retorna uma alocação ideal por classe baseada no cenário macroeconômico
+    # (para pesos por ativo, ver macro_scenarios.scenario_targets)
+    return MACRO_SCENARIOS[scenario].to_dict()
 
 # Sugestão de Rebalanceamento
+@timed("allocation.rebalance")
 def suggest_rebalance(current_portfolio_df, ideal_weights, allow_sales=True):
     # current_portfolio_df: DataFrame com 'Ativo', 'Quantidade', 'PrecoUnitario', 'ValorTotal', 'AlocacaoAtual'
     # ideal_weights: Series com pesos ideais para cada ativo
@@ -144,7 +137,7 @@ if __name__ == '__main__':
     portfolio_df = pd.DataFrame(portfolio_data)
 
     # 1. Identificação da classe de ativos
-    portfolio_df['Classe'] = portfolio_df['Ativo'].apply(identify_asset_class)
+    portfolio_df['Classe'] = classify_tickers(portfolio_df['Ativo'])
     print("\n--- Carteira com Classes de Ativos ---")
     print(portfolio_df)
 
@@ -192,6 +185,7 @@ if __name__ == '__main__':
 
 
 
+@timed("allocation.contribution")
 def suggest_new_contribution_allocation(current_portfolio_df, ideal_weights, new_contribution_value, valuation_scores=None):
     # current_portfolio_df: DataFrame com a carteira atual
     # ideal_weights: Series com os pesos ideais para cada ativo
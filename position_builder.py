@@ -0,0 +1,242 @@
+import csv
+import io
+import json
+import os
+import numpy as np
+import pandas as pd
+from ticker_registry import normalize_tickers
+
+# Construção incremental de posições a partir do histórico de negociações/eventos da corretora (B3).
+# Os arquivos são lidos em blocos (chunks), de modo que a memória fica limitada ao tamanho do bloco
+# mais o número de ativos distintos, independentemente de quantos milhões de linhas existam.
+
+# Colunas obrigatórias após o mapeamento (ver DEFAULT_COLUMN_MAP); 'Preco' é opcional para eventos
+REQUIRED_COLUMNS = ["Ativo", "Operacao", "Quantidade"]
+
+# Mapeamento padrão das colunas do extrato de negociação da B3 para as colunas internas
+DEFAULT_COLUMN_MAP = {
+    "Data do Negócio": "Data",
+    "Código de Negociação": "Ativo",
+    "Tipo de Movimentação": "Operacao",
+    "Quantidade": "Quantidade",
+    "Preço": "Preco",
+    "Entrada/Saída": "Direcao",
+}
+
+# Operações reconhecidas (comparação sem acento e em minúsculas)
+BUY_OPERATIONS = {"compra", "c", "buy"}
+SELL_OPERATIONS = {"venda", "v", "sell"}
+# Na exportação "Movimentação" da B3, a liquidação cobre créditos e débitos: o sentido vem da coluna
+# Entrada/Saída ('Direcao'); sem essa coluna, a linha é ignorada
+DIRECTIONAL_OPERATIONS = {"transferencia - liquidacao", "transferencia"}
+CREDIT_DIRECTIONS = {"credito", "entrada"}
+DEBIT_DIRECTIONS = {"debito", "saida"}
+# Eventos corporativos: 'Quantidade' é o fator multiplicativo da posição (ex: 2 em um desdobramento 1:2,
+# 0.1 em um grupamento 10:1). O custo total da posição não se altera.
+SPLIT_OPERATIONS = {"desdobramento", "grupamento", "split", "inplit"}
+# Bonificação: 'Quantidade' são as ações recebidas e 'Preco' o custo atribuído por ação
+BONUS_OPERATIONS = {"bonificacao", "bonificacao em ativos"}
+
+DEFAULT_CHUNKSIZE = 200_000
+
+def _normalize_operation(series):
+    return (
+        series.astype(str).str.strip().str.lower()
+        .str.normalize("NFKD").str.encode("ascii", errors="ignore").str.decode("ascii")
+    )
+
+def _parse_number(series, brazilian_format=False):
+    # Aceita números no formato brasileiro ("1.234,56") e no formato padrão ("1234.56").
+    # brazilian_format: arquivo no leiaute da B3 (';'), onde '.' é sempre separador de milhar ("1.000" = mil)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.astype(float)
+    text = series.astype(str).str.strip().str.replace("R$", "", regex=False).str.strip()
+    converted = text.str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    text = converted if brazilian_format else text.where(~text.str.contains(",", regex=False), converted)
+    return pd.to_numeric(text, errors="coerce").fillna(0.0)
+
+def _prepare_chunk(chunk, column_map, brazilian_format=False):
+    chunk = chunk.rename(columns=column_map)
+    missing = [col for col in REQUIRED_COLUMNS if col not in chunk.columns]
+    if missing:
+        raise ValueError(f"Colunas ausentes no histórico de transações: {missing}")
+
+    prepared = pd.DataFrame({
+        "Ativo": chunk["Ativo"].astype(str).str.strip().str.upper(),
+        "Operacao": _normalize_operation(chunk["Operacao"]),
+        "Quantidade": _parse_number(chunk["Quantidade"], brazilian_format),
+        "Preco": _parse_number(chunk["Preco"], brazilian_format) if "Preco" in chunk.columns else 0.0,
+    })
+    directional = prepared["Operacao"].isin(DIRECTIONAL_OPERATIONS)
+    if directional.any():
+        if "Direcao" in chunk.columns:
+            direction = _normalize_operation(chunk["Direcao"])
+            resolved = np.select([direction.isin(CREDIT_DIRECTIONS), direction.isin(DEBIT_DIRECTIONS)],
+                                 ["compra", "venda"], default="desconhecida")
+        else:
+            resolved = np.full(len(prepared), "desconhecida")
+        prepared.loc[directional, "Operacao"] = resolved[directional.to_numpy()]
+    # Ativos fracionários (ex: ITUB3F) são o mesmo ativo do lote padrão
+    fractional = prepared["Ativo"].str.match(r"^[A-Z]{4}\d{1,2}F$")
+    prepared.loc[fractional, "Ativo"] = prepared.loc[fractional, "Ativo"].str[:-1]
+    # Normalização dos tickers (mesma regra de add_sa_suffix_if_needed): cada código distinto é
+    # normalizado uma única vez por bloco, via lookup vetorizado no cadastro central
+    unique_tickers = pd.Series(prepared["Ativo"].unique())
+    normalized = dict(zip(unique_tickers, normalize_tickers(unique_tickers)))
+    prepared["Ativo"] = prepared["Ativo"].map(normalized)
+    return prepared
+
+def _detect_separator(source, encoding):
+    # Extratos da B3 costumam usar ';', exportações de outras corretoras usam ','
+    if hasattr(source, "read"):
+        header = source.readline()
+        source.seek(0)
+        if isinstance(header, bytes):
+            header = header.decode(encoding, errors="ignore")
+    else:
+        with open(source, "r", encoding=encoding) as f:
+            header = f.readline()
+    return ";" if header.count(";") > header.count(",") else ","
+
+def _apply_row(positions, ticker, operation, quantity, price):
+    quantity_held, total_cost = positions.get(ticker, (0.0, 0.0))
+
+    if operation in BUY_OPERATIONS or operation in BONUS_OPERATIONS:
+        quantity_held += quantity
+        total_cost += quantity * price
+    elif operation in SELL_OPERATIONS:
+        if quantity_held > 0:
+            # Venda reduz o custo pelo preço médio, que permanece inalterado
+            average_cost = total_cost / quantity_held
+            sold = min(quantity, quantity_held)
+            quantity_held -= sold
+            total_cost -= sold * average_cost
+        if quantity_held <= 1e-9:
+            quantity_held, total_cost = 0.0, 0.0
+    elif operation in SPLIT_OPERATIONS:
+        if quantity > 0:
+            quantity_held *= quantity
+    else:
+        # Operações desconhecidas (ex: rendimentos, juros) não alteram a posição
+        return
+
+    positions[ticker] = (quantity_held, total_cost)
+
+def _apply_chunk(positions, chunk):
+    for ticker, group in chunk.groupby("Ativo", sort=False):
+        operations = group["Operacao"]
+        if operations.isin(BUY_OPERATIONS).all():
+            # Caminho rápido: apenas compras no bloco, agregação vetorizada
+            quantity_held, total_cost = positions.get(ticker, (0.0, 0.0))
+            quantity_held += group["Quantidade"].sum()
+            total_cost += (group["Quantidade"] * group["Preco"]).sum()
+            positions[ticker] = (float(quantity_held), float(total_cost))
+        else:
+            # A ordem importa quando há vendas ou eventos: processa linha a linha apenas este ativo
+            for operation, quantity, price in zip(operations, group["Quantidade"], group["Preco"]):
+                _apply_row(positions, ticker, operation, quantity, price)
+
+def load_position_state(state_path):
+    # offsets: posição em bytes já processada de cada arquivo; row_offsets: contagem de linhas
+    # gravada por versões anteriores (convertida para bytes na próxima leitura do arquivo)
+    if state_path and os.path.exists(state_path):
+        with open(state_path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+        state["positions"] = {ticker: tuple(values) for ticker, values in state.get("positions", {}).items()}
+        if "byte_offsets" in state:
+            state["offsets"] = state.pop("byte_offsets")
+            state.setdefault("row_offsets", {})
+        else:
+            state["row_offsets"] = state.get("offsets", {})
+            state["offsets"] = {}
+        return state
+    return {"positions": {}, "offsets": {}, "row_offsets": {}}
+
+def save_position_state(state, state_path):
+    tmp_path = f"{state_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"positions": state["positions"], "byte_offsets": state["offsets"],
+                   "row_offsets": state["row_offsets"]}, f)
+    os.replace(tmp_path, state_path)
+
+def _read_header(handle, sep, encoding):
+    # Nomes das colunas a partir da primeira linha (o restante é lido a partir do deslocamento salvo)
+    header = handle.readline().decode(encoding, errors="ignore").lstrip("\ufeff")
+    return next(csv.reader(io.StringIO(header), delimiter=sep))
+
+def _skip_rows(handle, rows):
+    # Conversão de estados antigos (linhas já processadas): avança linha a linha, sem guardar nada
+    for _ in range(rows):
+        if not handle.readline():
+            break
+    return handle.tell()
+
+def update_positions_from_files(file_paths, state_path=None, column_map=None, chunksize=DEFAULT_CHUNKSIZE,
+                                sep=None, encoding="utf-8"):
+    # file_paths: lista de CSVs (caminhos ou arquivos abertos) com negociações e eventos, em ordem cronológica
+    # state_path: arquivo JSON com as posições e a posição (em bytes) já processada de cada arquivo.
+    #             Em execuções seguintes, o arquivo é lido a partir dessa posição: apenas as linhas
+    #             acrescentadas desde a última execução são lidas.
+    if isinstance(file_paths, (str, os.PathLike)) or hasattr(file_paths, "read"):
+        file_paths = [file_paths]
+    column_map = DEFAULT_COLUMN_MAP if column_map is None else column_map
+
+    state = load_position_state(state_path)
+    positions = state["positions"]
+
+    for path in file_paths:
+        file_sep = sep or _detect_separator(path, encoding)
+        brazilian_format = file_sep == ";"
+        # Arquivos abertos (ex: upload) não têm identidade estável entre execuções: são lidos por inteiro
+        if hasattr(path, "read"):
+            for chunk in pd.read_csv(path, sep=file_sep, encoding=encoding, dtype=str, chunksize=chunksize):
+                _apply_chunk(positions, _prepare_chunk(chunk, column_map, brazilian_format))
+            continue
+
+        key = os.path.abspath(path)
+        with open(path, "rb") as handle:
+            names = _read_header(handle, file_sep, encoding)
+            if key in state["offsets"]:
+                handle.seek(state["offsets"][key])
+            else:
+                _skip_rows(handle, state["row_offsets"].pop(key, 0))
+            if handle.read(1):
+                handle.seek(-1, os.SEEK_CUR)
+                reader = pd.read_csv(handle, sep=file_sep, encoding=encoding, dtype=str, header=None,
+                                     names=names, chunksize=chunksize)
+                for chunk in reader:
+                    _apply_chunk(positions, _prepare_chunk(chunk, column_map, brazilian_format))
+            state["offsets"][key] = handle.tell()
+
+    if state_path:
+        save_position_state(state, state_path)
+
+    return positions_to_portfolio(positions)
+
+def positions_to_portfolio(positions):
+    # Converte o estado agregado no DataFrame esperado por calculate_current_allocation
+    rows = [
+        {"Ativo": ticker, "Quantidade": quantity, "PrecoUnitario": total_cost / quantity}
+        for ticker, (quantity, total_cost) in positions.items()
+        if quantity > 1e-9
+    ]
+    return pd.DataFrame(rows, columns=["Ativo", "Quantidade", "PrecoUnitario"])
+
+# Exemplo de uso (para testes)
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Uso: python position_builder.py historico1.csv [historico2.csv ...] [--state estado.json]")
+        sys.exit(1)
+
+    args = sys.argv[1:]
+    state_file = None
+    if "--state" in args:
+        idx = args.index("--state")
+        state_file = args[idx + 1]
+        args = args[:idx] + args[idx + 2:]
+
+    portfolio_df = update_positions_from_files(args, state_path=state_file)
+    print("\n--- Posições Consolidadas ---")
+    print(portfolio_df)
@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from fundamentals_store import stored_tickers
+from instrumentation import timed
+from ticker_registry import DEFAULT_ASSETS, lookup_tickers, normalize_tickers
+from valuation import batch_valuation, calculate_opportunity_scores, get_buy_signals
+
+# Screener de oportunidades sobre o universo inteiro (não apenas a carteira atual).
+# Valuation, score e sinal são calculados em lote a partir dos fundamentos em cache; a seleção dos
+# melhores usa seleção parcial (argpartition), sem ordenar o universo inteiro.
+
+VALUATION_METHODS = ["DCF", "Graham", "Bazin", "DDM", "Valor Patrimonial"]
+
+def default_universe(include_stored=True):
+    # Universo padrão do app, mais (opcionalmente) todo ticker já presente no armazenamento
+    tickers = [ticker for group in DEFAULT_ASSETS.values() for ticker in group]
+    if include_stored:
+        tickers += stored_tickers("profile", period="snapshot")
+    return list(dict.fromkeys(tickers))
+
+@timed("screener.screen")
+def screen_universe(tickers=None, top_k=20, method="Graham", classes=None, min_liquidity=0.0,
+                    precomputed=None, **valuation_params):
+    # tickers: universo a avaliar (padrão: default_universe())
+    # method: valor intrínseco usado no score (uma das colunas de VALUATION_METHODS)
+    # classes: lista de classes de ativo aceitas (ex: ["Ações", "FII"]); None aceita todas
+    # min_liquidity: volume financeiro médio mínimo (volume médio * preço)
+    # precomputed: tabela de valuation já calculada (ex: cache_warmer.load_cached_valuation()); usada
+    # apenas com os parâmetros padrão, e só os tickers ausentes dela são calculados
+    if method not in VALUATION_METHODS:
+        raise ValueError(f"Método de valuation inválido: {method}")
+
+    tickers = pd.Series(default_universe() if tickers is None else list(tickers), dtype=object)
+    info = lookup_tickers(tickers)
+    info = info[~info["Simbolo"].duplicated()]
+    store_keys = (info["Simbolo"] + info["Sufixo"]).tolist()
+
+    if precomputed is not None and not valuation_params:
+        cached = precomputed.reindex(store_keys)
+        missing = [key for key in store_keys if key not in precomputed.index]
+        if missing:
+            cached.loc[missing] = batch_valuation(missing).reindex(columns=cached.columns).to_numpy()
+        valuation_df = cached.astype(float)
+    else:
+        valuation_df = batch_valuation(store_keys, **valuation_params)
+    # Índice pela chave normalizada (símbolo + sufixo), a mesma usada nas carteiras do position_builder
+    valuation_df.index = pd.Index(store_keys, name="Ativo")
+    valuation_df.insert(0, "Classe", info["Classe"].values)
+
+    mask = np.ones(len(valuation_df), dtype=bool)
+    if classes is not None:
+        mask &= valuation_df["Classe"].isin(classes).to_numpy()
+    if min_liquidity:
+        mask &= (valuation_df["Liquidez"].fillna(0) >= min_liquidity).to_numpy()
+    valuation_df = valuation_df[mask]
+
+    prices = valuation_df["Preço Atual"].to_numpy()
+    intrinsic = valuation_df[method].to_numpy()
+    scores = calculate_opportunity_scores(prices, intrinsic)
+    valuation_df["Score Oportunidade (%)"] = scores
+    valuation_df["Sinal"] = get_buy_signals(prices, intrinsic)
+
+    # Apenas ativos com valor intrínseco calculado entram no ranking
+    candidates = np.flatnonzero(~np.isnan(intrinsic))
+    if top_k and len(candidates) > top_k:
+        best = np.argpartition(-scores[candidates], top_k - 1)[:top_k]
+        candidates = candidates[best]
+    order = candidates[np.argsort(-scores[candidates], kind="stable")]
+    return valuation_df.iloc[order]
+
+def align_to_portfolio(screen_df, portfolio_assets):
+    # Reescreve o índice do screener com os rótulos da carteira ("ITUB3" ou "ITUB3.SA") para os
+    # ativos já possuídos, comparando pela chave normalizada dos dois lados
+    portfolio_assets = pd.Series(list(portfolio_assets), dtype=object)
+    held = dict(zip(normalize_tickers(portfolio_assets), portfolio_assets))
+    return screen_df.rename(index=held)
+
+def screener_to_contribution_inputs(screen_df, positive_only=True):
+    # Converte o resultado do screener nos argumentos de suggest_new_contribution_allocation:
+    # pesos ideais proporcionais ao score e dicionário de scores de valuation
+    scores = screen_df["Score Oportunidade (%)"]
+    if positive_only:
+        scores = scores[scores > 0]
+    if scores.empty or scores.sum() <= 0:
+        ideal_weights = pd.Series(dtype=float)
+    else:
+        ideal_weights = scores / scores.sum()
+    return ideal_weights, scores.to_dict()
+
+# Exemplo de uso (para testes)
+if __name__ == '__main__':
+    ranking = screen_universe(top_k=10)
+    print("\n--- Top 10 Oportunidades (Graham) ---")
+    print(ranking)
@@ -0,0 +1,137 @@
+import copy
+import hashlib
+import os
+import pickle
+import threading
+import time
+from instrumentation import increment
+
+try:
+    import fcntl
+except ImportError:  # Windows: apenas a deduplicação dentro do processo
+    fcntl = None
+
+# Deduplicação "single-flight": chamadas concorrentes com a mesma chave (função + argumentos)
+# compartilham uma única requisição em andamento e o seu resultado.
+# Dentro do processo, os seguidores esperam o líder em um Event. Entre processos da mesma máquina
+# (sessões do Streamlit, workers em lote), o líder de cada processo disputa um lock de arquivo:
+# quem esperava no lock enquanto o vencedor buscava encontra o resultado gravado por ele e não repete a
+# requisição. Quem chega depois de a busca terminar faz a própria chamada (não é um cache), e resultados
+# vazios (None, DataFrame/lista vazios) nunca são compartilhados.
+
+# Diretório dos locks/resultados entre processos (vazio desativa o modo entre processos)
+SINGLEFLIGHT_DIR = os.environ.get("SINGLEFLIGHT_DIR", os.path.join("data", "singleflight"))
+# Idade máxima de um resultado gravado por outro processo (0 desativa o compartilhamento entre processos)
+SHARED_RESULT_TTL = float(os.environ.get("SINGLEFLIGHT_TTL", "30"))
+
+_lock = threading.Lock()
+# chave -> [Event, resultado, exceção]
+_inflight = {}
+
+def _make_key(namespace, args, kwargs):
+    return f"{namespace}:{args!r}:{sorted(kwargs.items())!r}"
+
+def _is_empty(result):
+    if result is None:
+        return True
+    if getattr(result, "empty", False) is True:
+        return True
+    try:
+        return len(result) == 0
+    except TypeError:
+        return False
+
+def _read_shared_result(result_path, arrived_at):
+    # Apenas um resultado concluído depois da chegada deste chamador (ou seja, buscado enquanto ele
+    # esperava no lock); arquivos corrompidos ou de versões antigas do código caem na chamada ao vivo
+    try:
+        if time.time() - os.path.getmtime(result_path) <= SHARED_RESULT_TTL:
+            with open(result_path, "rb") as f:
+                finished_at, result = pickle.load(f)
+            if finished_at >= arrived_at:
+                return True, result
+    except Exception:
+        pass
+    return False, None
+
+def _write_shared_result(result_path, result):
+    if _is_empty(result):
+        return
+    tmp_path = f"{result_path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump((time.time(), result), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, result_path)
+    except (OSError, pickle.PickleError, TypeError) as e:
+        print(f"[SingleFlight] Erro ao compartilhar resultado: {e}")
+
+def _call_across_processes(key, func, args, kwargs):
+    if fcntl is None or not SINGLEFLIGHT_DIR:
+        return func(*args, **kwargs)
+
+    os.makedirs(SINGLEFLIGHT_DIR, exist_ok=True)
+    digest = hashlib.sha1(key.encode("utf-8")).hexdigest()
+    lock_path = os.path.join(SINGLEFLIGHT_DIR, f"{digest}.lock")
+    result_path = os.path.join(SINGLEFLIGHT_DIR, f"{digest}.pkl")
+
+    arrived_at = time.time()
+    with open(lock_path, "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            found, result = _read_shared_result(result_path, arrived_at)
+            if found:
+                increment("singleflight_shared", scope="machine")
+                return result
+            result = func(*args, **kwargs)
+            _write_shared_result(result_path, result)
+            return result
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def call_once(namespace, func, *args, cross_process=True, **kwargs):
+    # Executa func(*args, **kwargs) uma única vez por chave entre todos os chamadores concorrentes
+    key = _make_key(namespace, args, kwargs)
+    with _lock:
+        flight = _inflight.get(key)
+        leader = flight is None
+        if leader:
+            flight = [threading.Event(), None, None]
+            _inflight[key] = flight
+
+    if not leader:
+        increment("singleflight_shared", scope="process")
+        flight[0].wait()
+        if flight[2] is not None:
+            raise flight[2]
+        # Cópia rasa: um seguidor que altere o DataFrame/dict não afeta os demais
+        return copy.copy(flight[1])
+
+    try:
+        if cross_process:
+            flight[1] = _call_across_processes(key, func, args, kwargs)
+        else:
+            flight[1] = func(*args, **kwargs)
+        return flight[1]
+    except Exception as e:
+        flight[2] = e
+        raise
+    finally:
+        with _lock:
+            _inflight.pop(key, None)
+        flight[0].set()
+
+def purge_shared_results(max_age=3600):
+    # Remove locks/resultados entre processos mais antigos que max_age segundos
+    if not SINGLEFLIGHT_DIR or not os.path.isdir(SINGLEFLIGHT_DIR):
+        return 0
+    removed = 0
+    now = time.time()
+    for name in os.listdir(SINGLEFLIGHT_DIR):
+        path = os.path.join(SINGLEFLIGHT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+                removed += 1
+        except OSError:
+            pass
+    return removed
@@ -0,0 +1,141 @@
+import functools
+import numpy as np
+import pandas as pd
+
+# Cadastro central de tickers: símbolo -> classe, sufixo de bolsa, lote padrão e moeda.
+# É construído uma única vez por processo e indexado em memória; classificação e normalização de
+# colunas inteiras viram lookups vetorizados. Compartilhado por data_fetcher, portfolio_optimizer e app.py.
+
+B3_SUFFIX = ".SA"
+
+# Universo padrão exibido no app (mesmas chaves usadas na interface)
+DEFAULT_ASSETS = {
+    "Ações": ["ITUB3", "TOTS3", "MDIA3", "TAEE3", "BBSE3", "WEGE3", "PSSA3", "EGIE3", "PRIO3", "BBAS3", "BPAC11", "SBSP3", "SAPR4", "CMIG3", "AGRO3", "B3SA3", "VIVT3"],
+    "FIIs": ["MXRF11", "XPIN11", "VISC11", "XPLG11", "HGLG11", "ALZR11", "BCRI11", "HGRU11", "VILG11", "VGHF11", "KNRI11", "HGRE11", "BRCO11", "HGCR11", "VGIA11", "MALL11", "BTLG11", "BTLG12", "XPML11", "LVBI11", "TRXF11"],
+    "Exterior": ["IVV", "QQQM", "QUAL", "XLRE"],
+    "Renda Fixa": ["LCA", "LFT", "LTN", "DEBENTURES"]
+}
+
+# Units negociadas na B3 (código terminado em 11 que não é FII/ETF)
+KNOWN_UNITS = ["BPAC11", "TAEE11", "SAPR11", "KLBN11", "SANB11", "ALUP11", "ENGI11", "AESB11", "IGTI11", "BRBI11", "SULA11",
+               "CPLE11", "RNEW11", "PPLA11", "MODL11", "TIET11"]
+
+# FIIs frequentes fora do universo padrão (códigos 11 fora do cadastro não são assumidos como FII)
+KNOWN_FIIS = ["KNCR11", "KNIP11", "KNHY11", "KNSC11", "KFOF11", "HGBS11", "HFOF11", "RBRF11", "RBRR11", "RBRP11",
+              "RBRY11", "RBVA11", "VRTA11", "IRDM11", "CPTS11", "RECR11", "BCFF11", "XPCI11", "RZTR11", "RZAK11",
+              "VGIR11", "TGAR11", "HSML11", "PVBI11", "JSRE11", "GGRC11", "HCTR11", "DEVA11", "MCCI11", "BTCI11",
+              "SNAG11", "CVBI11", "VINO11", "BRCR11", "GARE11"]
+
+# ETFs negociados na B3 (também terminam em 11), separados pela exposição do índice de referência
+KNOWN_ETFS = {
+    "ETF": ["BOVA11", "BOVV11", "BOVX11", "BOVB11", "XBOV11", "SMAL11", "SMAC11", "DIVO11", "PIBB11", "BRAX11",
+            "ECOO11", "FIND11", "GOVE11", "MATB11", "ISUS11"],
+    "ETF (Exterior)": ["IVVB11", "SPXI11", "NASD11", "WRLD11", "ACWI11", "EURP11", "XINA11"],
+    "ETF (Renda Fixa)": ["IMAB11", "IRFM11", "FIXA11", "B5P211", "IB5M11", "LFTS11"],
+}
+
+# Atributos por classe para ativos fora do cadastro explícito
+_CLASS_ATTRIBUTES = {
+    "Ações": (B3_SUFFIX, 100, "BRL"),
+    "Ações (Units)": (B3_SUFFIX, 100, "BRL"),
+    "FII": (B3_SUFFIX, 1, "BRL"),
+    "ETF": (B3_SUFFIX, 1, "BRL"),
+    "ETF (Exterior)": (B3_SUFFIX, 1, "BRL"),
+    "ETF (Renda Fixa)": (B3_SUFFIX, 1, "BRL"),
+    # Código 11-14 fora do cadastro: pode ser FII, ETF, unit ou recibo/direito de subscrição
+    "Não Classificado (B3)": (B3_SUFFIX, 1, "BRL"),
+    "Exterior": ("", 1, "USD"),
+    "Renda Fixa": ("", 1, "BRL"),
+    "Outros": ("", 1, "BRL"),
+}
+
+# Código de negociação da B3: 4 letras (ou 3 letras + dígito, ex: B3SA3) seguidas do número do tipo de ativo
+_B3_PATTERN = r"^[A-Z0-9]{3}[A-Z]\d{1,2}$"
+
+def _build_entries():
+    entries = {}
+    group_to_class = {"Ações": "Ações", "FIIs": "FII", "Exterior": "Exterior", "Renda Fixa": "Renda Fixa"}
+    for group, tickers in DEFAULT_ASSETS.items():
+        for ticker in tickers:
+            entries[ticker] = group_to_class[group]
+    for ticker in KNOWN_FIIS:
+        entries[ticker] = "FII"
+    for ticker in KNOWN_UNITS:
+        entries[ticker] = "Ações (Units)"
+    for asset_class, tickers in KNOWN_ETFS.items():
+        for ticker in tickers:
+            entries[ticker] = asset_class
+    return entries
+
+@functools.lru_cache(maxsize=1)
+def get_registry():
+    # DataFrame indexado pelo símbolo (sem sufixo de bolsa)
+    entries = _build_entries()
+    registry = pd.DataFrame({"Classe": pd.Series(entries)})
+    registry.index.name = "Ativo"
+    attributes = registry["Classe"].map(_CLASS_ATTRIBUTES)
+    registry["Sufixo"] = attributes.str[0]
+    registry["Lote"] = attributes.str[1].astype(int)
+    registry["Moeda"] = attributes.str[2]
+    return registry
+
+def _base_symbols(tickers):
+    # Remove espaços, converte para maiúsculas e retira o sufixo de bolsa já existente
+    symbols = pd.Series(tickers, dtype=object).astype(str).str.strip().str.upper()
+    return symbols.str.replace(r"\.SA$", "", regex=True)
+
+def _infer_classes(symbols):
+    # Regras vetorizadas para símbolos fora do cadastro, pelo número do código de negociação da B3
+    is_b3 = symbols.str.match(_B3_PATTERN)
+    type_code = symbols.str.extract(r"(\d{1,2})$", expand=False)
+    conditions = [
+        is_b3 & type_code.isin(["3", "4", "5", "6", "7", "8"]),
+        is_b3 & type_code.isin(["32", "33", "34", "35", "39"]),  # BDRs
+        # FIIs, ETFs, units e recibos/direitos de subscrição: sem cadastro não há como distinguir
+        is_b3 & type_code.isin(["11", "12", "13", "14"]),
+    ]
+    choices = ["Ações", "Exterior", "Não Classificado (B3)"]
+    return pd.Series(np.select(conditions, choices, default="Outros"), index=symbols.index)
+
+def lookup_tickers(tickers):
+    # Retorna um DataFrame (na ordem de entrada) com Classe, Sufixo, Lote e Moeda para cada ticker
+    symbols = _base_symbols(tickers)
+    registry = get_registry()
+    result = registry.reindex(symbols.values)
+    result.index = symbols.index
+
+    unknown = result["Classe"].isna()
+    if unknown.any():
+        inferred = _infer_classes(symbols[unknown])
+        attributes = inferred.map(_CLASS_ATTRIBUTES)
+        result.loc[unknown, "Classe"] = inferred
+        result.loc[unknown, "Sufixo"] = attributes.str[0]
+        result.loc[unknown, "Lote"] = attributes.str[1]
+        result.loc[unknown, "Moeda"] = attributes.str[2]
+        # BDRs são negociados na B3, em reais, apesar da exposição ao exterior
+        is_bdr = unknown & symbols.str.match(_B3_PATTERN)
+        result.loc[is_bdr & (result["Classe"] == "Exterior"), ["Sufixo", "Moeda"]] = [B3_SUFFIX, "BRL"]
+
+    result.insert(0, "Simbolo", symbols)
+    result["Lote"] = result["Lote"].astype(int)
+    return result
+
+def classify_tickers(tickers):
+    # Versão vetorizada de identify_asset_class para uma coluna inteira
+    tickers = pd.Series(tickers)
+    classes = lookup_tickers(tickers)["Classe"]
+    classes.index = tickers.index
+    return classes
+
+def normalize_tickers(tickers):
+    # Versão vetorizada de add_sa_suffix_if_needed: símbolo + sufixo de bolsa do cadastro
+    tickers = pd.Series(tickers)
+    info = lookup_tickers(tickers)
+    normalized = info["Simbolo"] + info["Sufixo"]
+    normalized.index = tickers.index
+    return normalized
+
+@functools.lru_cache(maxsize=4096)
+def lookup_ticker(ticker):
+    # Versão escalar (com cache por símbolo) para chamadas ticker a ticker
+    return lookup_tickers([ticker]).iloc[0].to_dict()
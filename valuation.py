@@ -1,25 +1,33 @@
 
+import numpy as np
 import pandas as pd
-from data_fetcher import get_financial_statements, get_company_profile
+from data_fetcher import get_company_profile
+from instrumentation import timed
+from fundamentals_store import get_most_recent_fields, load_most_recent, load_profiles
 
 # --- Métodos de Valuation ---
 
+@timed("valuation.dcf")
 def calculate_dcf(ticker, growth_rate=0.05, discount_rate=0.10, terminal_growth_rate=0.02, years=5):
     # Simplificação: DCF requer projeções detalhadas de fluxo de caixa livre
-    # Para este exemplo, usaremos um placeholder baseado em receita ou lucro
+    # Para este exemplo, projetamos o último fluxo de caixa livre por ação com crescimento constante
     try:
-        income_statement = get_financial_statements(ticker, 'income-statement', period='annual')
-        if income_statement.empty:
+        latest_cash_flow = get_most_recent_fields(ticker, 'cash-flow-statement', ['freeCashFlow'])
+        profile = get_company_profile(ticker)
+        if not latest_cash_flow or not profile:
             return None
 
-        # Usar a receita como base para uma projeção simplificada de FCF
-        # Em um modelo real, FCF seria calculado a partir de DRE e Balanço
-        latest_revenue = income_statement.loc[0, 'revenue']
+        # Valor por ação (comparável ao preço): FCF da empresa dividido pelo número de ações
+        free_cash_flow = latest_cash_flow.get('freeCashFlow')
+        shares_outstanding = profile.get('sharesOutstanding')
+        if not free_cash_flow or free_cash_flow <= 0 or not shares_outstanding or shares_outstanding <= 0:
+            return None
+        latest_fcf_per_share = free_cash_flow / shares_outstanding
 
         projected_fcf = []
         for i in range(years):
             # Crescimento anual simplificado
-            fcf_year = latest_revenue * ((1 + growth_rate) ** (i + 1))
+            fcf_year = latest_fcf_per_share * ((1 + growth_rate) ** (i + 1))
             projected_fcf.append(fcf_year)
 
         # Valor Terminal (Perpetual Growth Model)
@@ -37,19 +45,18 @@ def calculate_dcf(ticker, growth_rate=0.05, discount_rate=0.10, terminal_growth_
         print(f"Erro ao calcular DCF para {ticker}: {e}")
         return None
 
+@timed("valuation.multiples")
 def calculate_multiples_valuation(ticker):
     try:
-        income_statement = get_financial_statements(ticker, 'income-statement', period='annual')
-        balance_sheet = get_financial_statements(ticker, 'balance-sheet-statement', period='annual')
+        # Dados mais recentes (apenas os campos usados são lidos do armazenamento colunar)
+        latest_income = get_most_recent_fields(ticker, 'income-statement', ['eps', 'ebitda'])
+        latest_balance = get_most_recent_fields(ticker, 'balance-sheet-statement',
+                                           ['bookValuePerShare', 'totalDebt', 'cashAndShortTermInvestments'])
         profile = get_company_profile(ticker)
 
-        if income_statement.empty or balance_sheet.empty or not profile:
+        if not latest_income or not latest_balance or not profile:
             return None
 
-        # Dados mais recentes
-        latest_income = income_statement.loc[0]
-        latest_balance = balance_sheet.loc[0]
-
         # Preço da ação e número de ações
         price = profile.get('price')
         shares_outstanding = profile.get('sharesOutstanding')
@@ -75,8 +82,8 @@ def calculate_multiples_valuation(ticker):
         # EV/EBITDA (Enterprise Value / EBITDA)
         # EV = Market Cap + Total Debt - Cash & Equivalents
         market_cap = price * shares_outstanding
-        total_debt = latest_balance.get('totalDebt', 0)
-        cash_and_equivalents = latest_balance.get('cashAndShortTermInvestments', 0)
+        total_debt = latest_balance.get('totalDebt') or 0
+        cash_and_equivalents = latest_balance.get('cashAndShortTermInvestments') or 0
         enterprise_value = market_cap + total_debt - cash_and_equivalents
 
         if ebitda and ebitda != 0:
@@ -87,15 +94,15 @@ def calculate_multiples_valuation(ticker):
         print(f"Erro ao calcular valuation por múltiplos para {ticker}: {e}")
         return None
 
-def calculate_graham_valuation(ticker):
+@timed("valuation.graham")
+def calculate_graham_valuation(ticker, growth_rate=0.05, aaa_bond_yield=0.06):
     try:
-        income_statement = get_financial_statements(ticker, 'income-statement', period='annual')
+        latest_income = get_most_recent_fields(ticker, 'income-statement', ['eps'])
         profile = get_company_profile(ticker)
 
-        if income_statement.empty or not profile:
+        if not latest_income or not profile:
             return None
 
-        latest_income = income_statement.loc[0]
         eps = latest_income.get('eps')
         book_value_per_share = profile.get('bookValuePerShare') # FMP tem no profile tb
 
@@ -109,26 +116,20 @@ def calculate_graham_valuation(ticker):
         # 4.4 = Rendimento médio de títulos corporativos AAA em 1962
         # Y = Rendimento atual de títulos corporativos AAA (usaremos uma taxa de juros de referência, ex: 10 anos)
 
-        # Para G, vamos usar uma estimativa simples, ou buscar um histórico de crescimento
-        # Por simplicidade, vamos usar um valor fixo ou tentar estimar do histórico de EPS
-        # Aqui, um placeholder para G
-        growth_rate_g = 0.05 # 5% de crescimento anual (exemplo)
-
-        # Para Y, usar uma taxa de juros de referência (ex: Selic ou títulos de longo prazo)
-        # No Brasil, pode ser a taxa de juros de longo prazo ou Selic
-        # Placeholder para Y
-        current_aaa_bond_yield = 0.06 # 6% (exemplo)
-
-        if current_aaa_bond_yield == 0:
+        # G: estimativa simples (padrão 5% ao ano); poderia vir do histórico de EPS
+        # Y: taxa de juros de referência (no Brasil, juros de longo prazo ou Selic; o app usa a taxa livre de risco)
+        # A fórmula usa G e Y em pontos percentuais (5, não 0.05)
+        if not aaa_bond_yield:
             return None
 
-        intrinsic_value = eps * (8.5 + 2 * growth_rate_g) * 4.4 / current_aaa_bond_yield
+        intrinsic_value = eps * (8.5 + 2 * growth_rate * 100) * 4.4 / (aaa_bond_yield * 100)
         return intrinsic_value
     except Exception as e:
         print(f"Erro ao calcular valuation de Graham para {ticker}: {e}")
         return None
 
-def calculate_bazin_valuation(ticker):
+@timed("valuation.bazin")
+def calculate_bazin_valuation(ticker, min_desired_yield=0.06):
     try:
         profile = get_company_profile(ticker)
         if not profile:
@@ -136,7 +137,6 @@ def calculate_bazin_valuation(ticker):
 
         # Preço Teto de Bazin = Dividendo por Ação / Yield Mínimo Desejado
         # Yield Mínimo Desejado geralmente é 6% (0.06)
-        min_desired_yield = 0.06
 
         # Precisamos do dividendo por ação (DPS)
         # FMP tem 'lastDividend' no perfil, mas é o último dividendo, não anualizado
@@ -163,6 +163,7 @@ def calculate_bazin_valuation(ticker):
         print(f"Erro ao calcular valuation de Bazin para {ticker}: {e}")
         return None
 
+@timed("valuation.ddm")
 def calculate_ddm_valuation(ticker, required_rate_of_return=0.10, growth_rate=0.03):
     # DDM (Dividend Discount Model) - Modelo de Gordon (crescimento constante)
     # Valor = Dividendo do Próximo Ano / (Taxa de Retorno Exigida - Taxa de Crescimento)
@@ -191,15 +192,15 @@ def calculate_ddm_valuation(ticker, required_rate_of_return=0.10, growth_rate=0.
         print(f"Erro ao calcular DDM para {ticker}: {e}")
         return None
 
+@timed("valuation.patrimonial")
 def calculate_patrimonial_value(ticker):
     try:
-        balance_sheet = get_financial_statements(ticker, 'balance-sheet-statement', period='annual')
+        latest_balance = get_most_recent_fields(ticker, 'balance-sheet-statement', ['totalEquity'])
         profile = get_company_profile(ticker)
 
-        if balance_sheet.empty or not profile:
+        if not latest_balance or not profile:
             return None
 
-        latest_balance = balance_sheet.loc[0]
         shares_outstanding = profile.get('sharesOutstanding')
 
         if not shares_outstanding or shares_outstanding <= 0:
@@ -237,9 +238,106 @@ def get_buy_signal(current_price, intrinsic_value):
     else:
         return "NEUTRO"
 
+# --- Valuation em lote (vetorizado, a partir dos dados em cache) ---
+
+def calculate_opportunity_scores(current_prices, intrinsic_values):
+    # Versão vetorizada de calculate_opportunity_score (0 quando preço ou valor intrínseco é inválido)
+    prices = np.asarray(current_prices, dtype=float)
+    values = np.asarray(intrinsic_values, dtype=float)
+    valid = ~np.isnan(values) & ~np.isnan(prices) & (prices > 0)
+    safe_prices = np.where(valid, prices, 1.0)
+    return np.where(valid, (values - safe_prices) / safe_prices * 100, 0.0)
+
+def get_buy_signals(current_prices, intrinsic_values):
+    # Versão vetorizada de get_buy_signal
+    prices = np.asarray(current_prices, dtype=float)
+    values = np.asarray(intrinsic_values, dtype=float)
+    invalid = np.isnan(values) | np.isnan(prices)
+    return np.select(
+        [invalid, values > prices, values < prices],
+        ["N/A", "COMPRA", "VENDA"],
+        default="NEUTRO",
+    )
+
+def load_valuation_inputs(tickers):
+    # Campos usados pelo valuation em lote, uma linha por ticker (sem duplicatas), lidos apenas das
+    # colunas necessárias do armazenamento colunar (sem chamadas de rede)
+    tickers = list(dict.fromkeys(str(ticker).upper() for ticker in tickers))
+    income = load_most_recent('income-statement', ['eps'], tickers=tickers).reindex(tickers)
+    balance = load_most_recent('balance-sheet-statement', ['totalEquity'], tickers=tickers).reindex(tickers)
+    cash_flow = load_most_recent('cash-flow-statement', ['freeCashFlow'], tickers=tickers).reindex(tickers)
+    profiles = load_profiles(tickers=tickers).reindex(tickers)
+    inputs = pd.concat([income, balance, cash_flow, profiles], axis=1).astype(float)
+    inputs.index = pd.Index(tickers, name='Ativo')
+    return inputs
+
+# Cada método abaixo recebe o resultado de load_valuation_inputs e devolve uma coluna (NaN sem dados),
+# com as mesmas fórmulas das funções individuais acima
+
+def _estimated_dps(inputs):
+    return (inputs['dividendYield'] * inputs['price']).where(lambda dps: dps > 0)
+
+def dcf_values(inputs, growth_rate=0.05, discount_rate=0.10, terminal_growth_rate=0.02, years=5):
+    if discount_rate <= terminal_growth_rate:
+        return pd.Series(np.nan, index=inputs.index)
+    # Soma a valor presente dos fluxos projetados + valor terminal (fatores calculados uma vez)
+    growth_factors = (1 + growth_rate) ** np.arange(1, years + 1)
+    discount_factors = (1 + discount_rate) ** np.arange(1, years + 1)
+    dcf_multiplier = (growth_factors / discount_factors).sum()
+    terminal_multiplier = growth_factors[-1] * (1 + terminal_growth_rate) / (discount_rate - terminal_growth_rate)
+    dcf_multiplier += terminal_multiplier / discount_factors[-1]
+    # Por ação (comparável ao preço); FCF negativo não tem valor intrínseco por este método
+    shares = inputs['sharesOutstanding'].where(inputs['sharesOutstanding'] > 0)
+    fcf_per_share = inputs['freeCashFlow'].where(inputs['freeCashFlow'] > 0) / shares
+    return fcf_per_share * dcf_multiplier
+
+def graham_values(inputs, aaa_bond_yield=0.06, growth_rate=0.05):
+    if not aaa_bond_yield:
+        return pd.Series(np.nan, index=inputs.index)
+    eps = inputs['eps'].where(inputs['eps'] != 0)
+    # G e Y em pontos percentuais, como na fórmula original
+    return (eps * (8.5 + 2 * growth_rate * 100) * 4.4 / (aaa_bond_yield * 100)).where(inputs['bookValuePerShare'] > 0)
+
+def bazin_values(inputs, min_desired_yield=0.06):
+    if not min_desired_yield:
+        return pd.Series(np.nan, index=inputs.index)
+    return _estimated_dps(inputs) / min_desired_yield
+
+def ddm_values(inputs, required_rate_of_return=0.10, growth_rate=0.03):
+    if required_rate_of_return <= growth_rate:
+        return pd.Series(np.nan, index=inputs.index)
+    return _estimated_dps(inputs) * (1 + growth_rate) / (required_rate_of_return - growth_rate)
+
+def patrimonial_values(inputs):
+    shares = inputs['sharesOutstanding'].where(inputs['sharesOutstanding'] > 0)
+    return inputs['totalEquity'].where(inputs['totalEquity'] != 0) / shares
+
+def liquidity_values(inputs):
+    # Volume financeiro médio (volume médio * preço)
+    return inputs['volAvg'] * inputs['price']
+
+@timed("valuation.batch")
+def batch_valuation(tickers, growth_rate=0.05, discount_rate=0.10, terminal_growth_rate=0.02, years=5,
+                    min_desired_yield=0.06, aaa_bond_yield=0.06, graham_growth_rate=0.05,
+                    ddm_required_return=0.10, ddm_growth_rate=0.03):
+    # Calcula DCF, Graham, Bazin, DDM e valor patrimonial de todos os tickers de uma vez a partir dos
+    # dados em cache; tickers sem dados ficam com NaN
+    requested = [str(ticker).upper() for ticker in tickers]
+    inputs = load_valuation_inputs(requested)
+    valuation_df = pd.DataFrame({
+        'Preço Atual': inputs['price'],
+        'DCF': dcf_values(inputs, growth_rate, discount_rate, terminal_growth_rate, years),
+        'Graham': graham_values(inputs, aaa_bond_yield, graham_growth_rate),
+        'Bazin': bazin_values(inputs, min_desired_yield),
+        'DDM': ddm_values(inputs, ddm_required_return, ddm_growth_rate),
+        'Valor Patrimonial': patrimonial_values(inputs),
+        'Liquidez': liquidity_values(inputs),
+    })
+    return valuation_df.astype(float).reindex(requested)
+
 # Exemplo de uso (para testes)
 if __name__ == '__main__':
-    # Lembre-se de substituir 'SUA_CHAVE_FMP_AQUI' em data_fetcher.py
+    # Lembre-se de definir a variável de ambiente FMP_API_KEY (ou DATA_PROVIDER=synthetic para rodar offline)
     ticker_test = 'ITUB3.SA'
     
     print(f"\n--- Valuation para {ticker_test} ---")